@@ -0,0 +1 @@
+"""Benchmarks for the stand-in notifier; see run.py."""
@@ -0,0 +1,49 @@
+# benchmarks/compare.py
+
+"""Compares two benchmark result files metric by metric.
+
+    python -m benchmarks.compare baseline.json results.json
+"""
+
+import argparse
+import json
+
+def flatten(results, prefix=''):
+    """Returns {'targets.sqlite.parse.1000.stream.seconds': value} for every numeric leaf."""
+    values = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares two benchmark result files.")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help="only list changes larger than this many percent (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    print(f"{baseline.get('commit') or 'baseline'} -> {current.get('commit') or 'current'}")
+
+    old = flatten(baseline.get('targets', {}))
+    new = flatten(current.get('targets', {}))
+    for path in sorted(old.keys() & new.keys()):
+        # Counts such as subscribers or outbox_rows describe the run, not its speed
+        if not old[path] or not path.endswith(('seconds', 'per_second')):
+            continue
+        change = (new[path] - old[path]) / old[path] * 100
+        if abs(change) >= args.threshold:
+            # Durations should go down, rates should go up
+            worse = change < 0 if path.endswith('per_second') else change > 0
+            print(f"{'WORSE ' if worse else 'better'} {change:+8.1f}%  {path}: {old[path]:.6g} -> {new[path]:.6g}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/pages.py
+
+"""Synthetic schedule pages shaped like the school's table.live pages."""
+
+import random
+from datetime import date, timedelta
+from itertools import product
+
+HUNGARIAN_MONTHS = (
+    'január', 'február', 'március', 'április', 'május', 'június',
+    'július', 'augusztus', 'szeptember', 'október', 'november', 'december'
+)
+HUNGARIAN_WEEKDAYS = ('hétfő', 'kedd', 'szerda', 'csütörtök', 'péntek', 'szombat', 'vasárnap')
+
+SURNAMES = (
+    'Nagy', 'Kovács', 'Tóth', 'Szabó', 'Horváth', 'Varga', 'Kiss', 'Molnár', 'Németh', 'Farkas',
+    'Balogh', 'Papp', 'Takács', 'Juhász', 'Lakatos', 'Mészáros', 'Oláh', 'Simon', 'Rácz', 'Fekete'
+)
+GIVEN_NAMES = ('Anna', 'Eszter', 'Katalin', 'Zsófia', 'Péter', 'Gábor', 'László', 'Tamás', 'Judit', 'Ádám')
+SUBJECTS = (
+    'matematika', 'magyar nyelv', 'irodalom', 'történelem', 'fizika', 'kémia', 'biológia',
+    'földrajz', 'angol nyelv', 'német nyelv', 'informatika', 'testnevelés', 'ének-zene', 'rajz'
+)
+COMMENTS = ('', '', '', 'összevonás', 'elmarad', 'terem csere', 'dolgozatírás')
+CLASSES = tuple(f'{grade}.{letter}' for grade in range(9, 13) for letter in 'ABCDEF')
+TEACHERS = tuple(f'{surname} {given}' for surname, given in product(SURNAMES, GIVEN_NAMES))
+LESSONS = tuple(str(lesson) for lesson in range(0, 9))
+
+COLUMN_TITLES = ('Helyettesítő', 'Óra', 'Osztály', 'Tárgy', 'Terem', 'Hiányzó', 'Megjegyzés')
+
+def hungarian_caption(day):
+    """Returns a caption such as '2026. október 19., hétfő', as the page shows it."""
+    return f"{day.year}. {HUNGARIAN_MONTHS[day.month - 1]} {day.day}., {HUNGARIAN_WEEKDAYS[day.weekday()]}"
+
+def school_days(start, count):
+    """Returns the next count weekdays from start."""
+    days = []
+    day = start
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def random_entry(rng, lesson, class_name, missing_teacher):
+    return {
+        'stand_in_teacher': rng.choice(TEACHERS),
+        'lesson': lesson,
+        'class': class_name,
+        'subject': rng.choice(SUBJECTS),
+        'room': str(rng.randint(1, 250)),
+        'missing_teacher': missing_teacher,
+        'comment': rng.choice(COMMENTS),
+    }
+
+def generate_schedule(rows, dates=3, start=None, seed=0):
+    """Returns {date: [entry dict]} with rows entries spread over dates school days.
+
+    Entry keys (lesson, class, missing teacher) are unique per date, like on
+    the real page, and the same seed always yields the same schedule.
+    """
+    rng = random.Random(seed)
+    keys = list(product(LESSONS, CLASSES, TEACHERS))
+    schedule = {}
+    for i, day in enumerate(school_days(start or date.today(), dates)):
+        count = rows // dates + (1 if i < rows % dates else 0)
+        picked = sorted(rng.sample(keys, count), key=lambda key: (int(key[0]), key[1]))
+        schedule[day] = [random_entry(rng, *key) for key in picked]
+    return schedule
+
+def mutate_schedule(schedule, fraction=0.1, seed=1):
+    """Returns a copy of schedule where about fraction of the entries changed.
+
+    A third of the touched entries get a new room, a third are removed and a
+    third are replaced by new entries.
+    """
+    rng = random.Random(seed)
+    mutated = {}
+    for day, entries in schedule.items():
+        taken = {(entry['lesson'], entry['class'], entry['missing_teacher']) for entry in entries}
+        result = []
+        for entry in entries:
+            if rng.random() >= fraction:
+                result.append(entry)
+                continue
+            action = rng.randrange(3)
+            if action == 0:
+                result.append(dict(entry, room=str(rng.randint(251, 300))))
+            elif action == 2:
+                while True:
+                    key = (rng.choice(LESSONS), rng.choice(CLASSES), rng.choice(TEACHERS))
+                    if key not in taken:
+                        break
+                taken.add(key)
+                result.append(random_entry(rng, *key))
+        mutated[day] = result
+    return mutated
+
+def render_page(schedule):
+    """Renders a schedule as an HTML page with one table.live per date."""
+    parts = [
+        '<!DOCTYPE html>\n<html lang="hu">\n<head><meta charset="utf-8"><title>Helyettesítések</title></head>\n<body>\n',
+        '<h1>Helyettesítések</h1>\n',
+    ]
+    header = ''.join(f'<th>{title}</th>' for title in COLUMN_TITLES)
+    for day, entries in schedule.items():
+        parts.append(f'<table class="live">\n<caption>{hungarian_caption(day)}</caption>\n')
+        parts.append(f'<thead><tr>{header}</tr></thead>\n<tbody>\n')
+        for entry in entries:
+            cells = (
+                entry['stand_in_teacher'], entry['lesson'], entry['class'], entry['subject'],
+                entry['room'], entry['missing_teacher'], entry['comment']
+            )
+            parts.append('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>\n')
+        parts.append('</tbody>\n</table>\n')
+    parts.append('</body>\n</html>\n')
+    return ''.join(parts)
@@ -0,0 +1,167 @@
+# benchmarks/replay.py
+
+"""Replays archived schedule pages through parsing, the schedule diff and notify_clients.
+
+Reads a snapshot directory written with SNAPSHOT_DIR and feeds its pages, in
+the order they were fetched, into a fresh database as fast as possible.
+Notifications stay in the outbox unless --deliver sends them to a local SMTP
+stand-in. The results can be compared with benchmarks.compare.
+
+    python -m benchmarks.replay snapshots/ --subscribers 20 --output replay.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.run import elapsed, git_commit, isolate_environment, reset_database
+from benchmarks.stand_ins import SMTPSink
+
+# Operations reported from the notifier's operation_seconds histogram, for the replay and the delivery
+PIPELINE_OPERATIONS = ('parse_html', 'parse_date', 'schedule_diff', 'schedule_commit')
+DELIVERY_OPERATIONS = ('compose_digest', 'send_email')
+
+def operation_totals(app, operations):
+    return {operation: app.operation_seconds.total(operation=operation) for operation in operations}
+
+def operations_since(app, before):
+    return {operation: {'seconds': total - before[operation]} for operation, total in operation_totals(app, before).items()}
+
+def add_subscribers(app, snapshots, per_class):
+    """Registers per_class subscribers for every class that appears in the snapshots."""
+    from sqlalchemy import insert
+
+    classes = set()
+    seen = set()
+    for record, html in snapshots:
+        if record['hash'] in seen:
+            continue
+        seen.add(record['hash'])
+        for entries in app.parse_html(html).values():
+            classes.update((record['source'], entry['class'].upper()) for entry in entries)
+
+    with app.session_scope() as session:
+        session.execute(insert(app.Client), [
+            {'email': f'subscriber{i}.{class_name}.{source_id}@localhost', 'name': f'Subscriber {i}',
+             'class_name': class_name, 'language': 'english', 'source_id': source_id}
+            for source_id, class_name in sorted(classes) for i in range(per_class)
+        ])
+    app.subscriber_index.load()
+    return len(classes) * per_class
+
+def unsent_outbox(app):
+    with app.SessionLocal() as session:
+        return session.query(app.OutboxMessage).filter(
+            app.OutboxMessage.sent_at.is_(None),
+            app.OutboxMessage.attempts < app.OUTBOX_MAX_ATTEMPTS
+        ).count()
+
+def deliver(app, timeout):
+    """Delivers the outbox to the SMTP stand-in until it is empty; returns the seconds it took."""
+    start = time.perf_counter()
+    while unsent_outbox(app) and time.perf_counter() - start < timeout:
+        app.deliver_outbox()
+        time.sleep(0.05)
+    return time.perf_counter() - start
+
+def replay(app, snapshots):
+    """Processes every snapshot as a fetch of its source, with the status it was fetched with."""
+    sources = {}
+    for record, html in snapshots:
+        source = sources.get(record['source'])
+        if source is None:
+            source = sources[record['source']] = app.Source(id=record['source'], url=record['url'], enabled=True)
+        app.process_fetch_result(source, app.FetchResult(record['status'], html=html, content_hash=record['hash']))
+
+def run_replay(directory, subscribers, limit, smtp, timeout):
+    import stand_in_notifier as app
+
+    snapshots = list(app.read_snapshots(directory))[:limit]
+    reset_database(app)
+    registered = add_subscribers(app, snapshots, subscribers) if subscribers else 0
+
+    # Finding the classes parsed every page once already
+    before = operation_totals(app, PIPELINE_OPERATIONS)
+    seconds = elapsed(replay, app, snapshots)
+    with app.SessionLocal() as session:
+        outbox_rows = session.query(app.OutboxMessage).count()
+    results = {
+        'snapshots': len(snapshots),
+        'pages': len({record['hash'] for record, _ in snapshots}),
+        'subscribers': registered,
+        'seconds': seconds,
+        'snapshots_per_second': len(snapshots) / seconds if seconds else 0,
+        'rows_parsed': sum(app.rows_parsed_total.value(source=source) for source in {record['source'] for record, _ in snapshots}),
+        'rows_changed': {change: app.rows_changed_total.value(change=change) for change in ('new', 'updated', 'removed')},
+        'outbox_rows': outbox_rows,
+        'operations': operations_since(app, before),
+    }
+    if smtp is not None:
+        before = operation_totals(app, DELIVERY_OPERATIONS)
+        delivery_seconds = deliver(app, timeout)
+        results['delivery'] = {
+            'seconds': delivery_seconds,
+            'messages': smtp.count,
+            'messages_per_second': smtp.count / delivery_seconds if delivery_seconds else 0,
+            'unsent': unsent_outbox(app),
+            'operations': operations_since(app, before),
+        }
+    app.dispatcher.stop(timeout=30)
+    app.smtp_pool.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays archived schedule pages through the notifier's pipeline.")
+    parser.add_argument('directory', help="snapshot directory, as configured with SNAPSHOT_DIR")
+    parser.add_argument('--subscribers', type=int, default=10, help="subscribers per class seen in the snapshots")
+    parser.add_argument('--limit', type=int, help="only replay the first this many snapshots")
+    parser.add_argument('--database', help="database to replay into (default: a temporary SQLite file); "
+                                           "its tables are dropped and recreated")
+    parser.add_argument('--deliver', action='store_true',
+                        help="send the notifications to a local SMTP stand-in instead of leaving them in the outbox")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for the delivery")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    smtp = SMTPSink() if args.deliver else None
+    with tempfile.TemporaryDirectory() as directory:
+        isolate_environment({
+            'DATABASE_URL': args.database or f"sqlite:///{os.path.join(directory, 'replay.db')}",
+            'BOT_EMAIL': 'bot@localhost',
+            'EMAIL_PASSWORD': 'replay',
+            'SMTP_SERVER': '127.0.0.1',
+            # Without --deliver nothing is sent, so the port is never connected to
+            'SMTP_PORT': str(smtp.port if smtp else 25),
+            'SMTP_STARTTLS': 'false',
+            'NOTIFY_DIGEST_WINDOW': '0',
+            'SMTP_RATE_LIMIT': '1000000',
+            'SMTP_RATE_BURST': '1000000',
+            'LEADER_ELECTION': 'false',
+            'METRICS_PORT': '0',
+            'LOG_LEVEL': 'WARNING',
+            'SNAPSHOT_DIR': '',
+            'SCHEDULE_RETENTION_DAYS': '0',
+        })
+        print(f"Replaying {args.directory}...", file=sys.stderr)
+        results = {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'targets': {'replay': run_replay(args.directory, args.subscribers, args.limit, smtp, args.timeout)},
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
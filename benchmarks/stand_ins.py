@@ -0,0 +1,303 @@
+# benchmarks/stand_ins.py
+
+"""Local stand-ins for the schedule page, the SMTP relay and the IMAP inbox.
+
+Each one runs on 127.0.0.1 on a free port, in daemon threads, and speaks just
+enough of its protocol for the notifier.
+"""
+
+import hashlib
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandIn:
+    """Runs a socketserver on a free local port in a daemon thread.
+
+    Handlers report their connections, so tests can count sessions and cut
+    them like a server restart would.
+    """
+
+    def __init__(self, server):
+        self.connections = set()
+        self.sessions = 0
+        self._connections_lock = threading.Lock()
+        self.server = server
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        self.port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connected(self, connection):
+        with self._connections_lock:
+            self.connections.add(connection)
+            self.sessions += 1
+
+    def disconnected(self, connection):
+        with self._connections_lock:
+            self.connections.discard(connection)
+
+    def drop_connections(self):
+        """Cuts every open session, like a server restart or a network failure."""
+        with self._connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class TrackedHandler(socketserver.StreamRequestHandler):
+    """Reports the connection to its stand-in around serve()."""
+
+    def handle(self):
+        stand_in = self.server.stand_in
+        stand_in.connected(self.connection)
+        try:
+            self.serve(stand_in)
+        finally:
+            stand_in.disconnected(self.connection)
+
+# ---------------------------------------
+# HTTP
+# ---------------------------------------
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        page = self.server.stand_in.pages.get(self.path)
+        if page is None:
+            self.send_error(404)
+            return
+        body, etag = page
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class SchedulePageServer(StandIn):
+    """Serves schedule pages by path, with ETags so conditional fetches get 304s."""
+
+    def __init__(self):
+        self.pages = {}
+        super().__init__(ThreadingHTTPServer(('127.0.0.1', 0), PageHandler))
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def set_page(self, path, html):
+        body = html.encode('utf-8')
+        self.pages[path] = (body, '"' + hashlib.sha256(body).hexdigest()[:16] + '"')
+
+# ---------------------------------------
+# SMTP
+# ---------------------------------------
+
+class SMTPHandler(TrackedHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def serve(self, sink):
+        self.reply('220 localhost stand-in ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif command.startswith('AUTH'):
+                sink.logged_in()
+                self.reply('235 Authentication successful')
+            elif command.startswith('MAIL') and sink.hang_up:
+                return
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in iter(self.rfile.readline, b''):
+                    if line == b'.\r\n':
+                        break
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                sink.received(b''.join(data))
+                self.reply('250 OK queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class SMTPSink(StandIn):
+    """Accepts and counts messages and logins without STARTTLS; any login succeeds.
+
+    With hang_up set, the sink closes the connection instead of accepting a
+    message, like a relay that drops idle or overloaded sessions. With
+    keep_messages set, the raw messages are kept in messages.
+    """
+
+    def __init__(self, keep_messages=False):
+        self.count = 0
+        self.logins = 0
+        self.hang_up = False
+        self.keep_messages = keep_messages
+        self.messages = []
+        self._condition = threading.Condition()
+        super().__init__(socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler))
+
+    def logged_in(self):
+        with self._condition:
+            self.logins += 1
+
+    def received(self, data):
+        with self._condition:
+            self.count += 1
+            if self.keep_messages:
+                self.messages.append(data)
+            self._condition.notify_all()
+
+    def wait_for(self, count, timeout):
+        """Waits until count messages arrived in total; returns whether they did."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.count < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+# ---------------------------------------
+# IMAP
+# ---------------------------------------
+
+FETCH_RANGE = re.compile(r'<(\d+)\.(\d+)>')
+
+def parse_uid_set(uid_set):
+    uids = set()
+    for part in uid_set.split(','):
+        if ':' in part:
+            first, last = part.split(':')
+            uids.update(range(int(first), int(last) + 1))
+        else:
+            uids.add(int(part))
+    return uids
+
+class IMAPHandler(TrackedHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+    def serve(self, inbox):
+        self.reply(f'* OK [CAPABILITY {inbox.capabilities}] stand-in ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode('utf-8', errors='replace').strip().partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            if command == 'CAPABILITY':
+                self.reply(f'* CAPABILITY {inbox.capabilities}')
+            elif command == 'SELECT':
+                self.reply(f'* {len(inbox.messages)} EXISTS')
+                self.reply('* FLAGS (\\Seen)')
+            elif command == 'UID':
+                self.handle_uid(inbox, args)
+            elif command == 'IDLE' and inbox.idle:
+                if not self.handle_idle(inbox, tag):
+                    return
+                continue
+            elif command == 'LOGOUT':
+                self.reply('* BYE stand-in closing')
+                self.reply(f'{tag} OK LOGOUT completed')
+                return
+            elif command not in ('LOGIN', 'NOOP'):
+                self.reply(f'{tag} BAD unsupported command')
+                continue
+            self.reply(f'{tag} OK {command} completed')
+
+    def handle_idle(self, inbox, tag):
+        """Reports new mail with EXISTS until the client sends DONE; returns False if it hung up."""
+        self.reply('+ idling')
+        with inbox.lock:
+            reported = len(inbox.messages)
+        while True:
+            with inbox.lock:
+                exists = len(inbox.messages)
+            if exists != reported:
+                self.reply(f'* {exists} EXISTS')
+                reported = exists
+            if select.select([self.connection], [], [], 0.05)[0]:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b'DONE':
+                    self.reply(f'{tag} OK IDLE terminated')
+                    return True
+                self.reply(f'{tag} BAD expected DONE')
+
+    def handle_uid(self, inbox, args):
+        command, _, args = args.partition(' ')
+        command = command.upper()
+        with inbox.lock:
+            if command == 'SEARCH':
+                unseen = [str(uid) for uid, message in inbox.messages.items() if not message[1]]
+                self.reply('* SEARCH ' + ' '.join(unseen))
+            elif command == 'FETCH':
+                uid_set, _, items = args.partition(' ')
+                window = FETCH_RANGE.search(items)
+                for seq, uid in enumerate(sorted(parse_uid_set(uid_set) & inbox.messages.keys()), 1):
+                    body = inbox.messages[uid][0]
+                    if window:
+                        body = body[int(window.group(1)):int(window.group(1)) + int(window.group(2))]
+                    self.wfile.write(f'* {seq} FETCH (UID {uid} BODY[]<0> {{{len(body)}}}\r\n'.encode('ascii'))
+                    self.wfile.write(body + b')\r\n')
+            elif command == 'STORE':
+                uid_set = args.partition(' ')[0]
+                for uid in parse_uid_set(uid_set) & inbox.messages.keys():
+                    inbox.messages[uid][1] = True
+
+class IMAPInbox(StandIn):
+    """Holds messages in memory and serves SEARCH UNSEEN, FETCH and STORE \\Seen by UID, without TLS.
+
+    With idle set it also advertises and serves IDLE, reporting deliveries
+    with an untagged EXISTS.
+    """
+
+    def __init__(self, idle=False):
+        self.messages = {}  # uid -> [raw message, seen]
+        self.idle = idle
+        self.capabilities = 'IMAP4rev1 IDLE' if idle else 'IMAP4rev1'
+        self.lock = threading.Lock()
+        super().__init__(socketserver.ThreadingTCPServer(('127.0.0.1', 0), IMAPHandler))
+
+    def deliver(self, raw_messages):
+        with self.lock:
+            uid = max(self.messages, default=0)
+            for raw in raw_messages:
+                uid += 1
+                self.messages[uid] = [raw, False]
+
+    def unseen(self):
+        with self.lock:
+            return sum(1 for _, seen in self.messages.values() if not seen)
@@ -1,32 +1,51 @@
-from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from stand_in_notifier import ScheduleEntry, DATABASE_URL  # Replace 'your_module' with the name of your script/module
+from datetime import date, datetime, timedelta
+import argparse
+from sqlalchemy import delete, select, update
+from stand_in_notifier import FetchState, ScheduleEntry, Source, purge_expired_data, session_scope  # Replace 'your_module' with the name of your script/module
 
-def clear_entries():
-    """Deletes schedule entries for today and tomorrow."""
-    # Create database engine and session
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(bind=engine)
-    session = SessionLocal()
+def clear_entries(first, last, source_id=None):
+    """Deletes the schedule entries from first to last, both included, with a single statement.
 
-    # Get today's and tomorrow's dates
-    today = datetime.now().date()
-    tomorrow = today + timedelta(days=1)
+    The stored page hashes are reset too, so the next poll parses the pages
+    again and announces the entries that are still on them as new.
+    """
+    stmt = delete(ScheduleEntry).where(ScheduleEntry.date.between(first, last))
+    states = update(FetchState).values(etag=None, last_modified=None, content_hash=None)
+    if source_id:
+        stmt = stmt.where(ScheduleEntry.source_id == source_id)
+        states = states.where(FetchState.url.in_(select(Source.url).where(Source.id == source_id)))
 
     try:
-        # Delete entries for today
-        today_deleted = session.query(ScheduleEntry).filter(ScheduleEntry.date == today).delete()
-        # Delete entries for tomorrow
-        tomorrow_deleted = session.query(ScheduleEntry).filter(ScheduleEntry.date == tomorrow).delete()
-        session.commit()
-        print(f"Deleted {today_deleted} entries for {today}")
-        print(f"Deleted {tomorrow_deleted} entries for {tomorrow}")
+        with session_scope() as session:
+            deleted = session.execute(stmt).rowcount
+            session.execute(states)
+        print(f"Deleted {deleted} entries from {first} to {last}")
     except Exception as e:
-        session.rollback()
         print(f"An error occurred: {e}")
-    finally:
-        session.close()
+
+def main(argv=None):
+    today = datetime.now().date()
+    parser = argparse.ArgumentParser(
+        description="Deletes schedule entries of a date range, today and tomorrow by default. "
+                    "The next poll stores and announces the entries still on the page again."
+    )
+    parser.add_argument('first', nargs='?', type=date.fromisoformat,
+                        help="first date to delete, YYYY-MM-DD (default: today)")
+    parser.add_argument('last', nargs='?', type=date.fromisoformat,
+                        help="last date to delete (default: first, or tomorrow if first isn't given)")
+    parser.add_argument('--source', help="only delete entries of this school")
+    parser.add_argument('--purge', action='store_true',
+                        help="instead run the retention job once, deleting data older than SCHEDULE_RETENTION_DAYS")
+    args = parser.parse_args(argv)
+
+    if args.purge:
+        purge_expired_data()
+        return
+    first = args.first or today
+    last = args.last or (first if args.first else today + timedelta(days=1))
+    if last < first:
+        parser.error("last must not be before first")
+    clear_entries(first, last, args.source)
 
 if __name__ == '__main__':
-    clear_entries()
+    main()
@@ -2,19 +2,38 @@
 
 import os
 import logging
-import requests
-from bs4 import BeautifulSoup
-import smtplib
-import imaplib
+import argparse
+import asyncio
+import bisect
+import functools
+import gzip
+import json
+from contextlib import contextmanager
+import signal
+import hashlib
+import re
+import socket
+import tempfile
+import html as html_lib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from string import Template
 import email
+import threading
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import queue
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email_validator import validate_email, EmailNotValidError
 from datetime import datetime, timedelta
 import schedule
 import time
-from sqlalchemy import create_engine, Column, Integer, String, Date, UniqueConstraint
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import create_engine, delete, func, inspect, or_, select, text, tuple_, update, Boolean, Column, Index, Integer, String, Date, DateTime, UniqueConstraint
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import aliased, declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # ---------------------------------------
@@ -30,8 +49,18 @@ BOT_EMAIL = os.getenv('BOT_EMAIL')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 IMAP_SERVER = os.getenv('IMAP_SERVER')
 IMAP_PORT = int(os.getenv('IMAP_PORT', '993'))
+IMAP_SSL = os.getenv('IMAP_SSL', 'true').lower() == 'true'
+IMAP_IDLE = os.getenv('IMAP_IDLE', 'false').lower() == 'true'  # push mode instead of polling
+IMAP_IDLE_TIMEOUT = int(os.getenv('IMAP_IDLE_TIMEOUT', '300'))  # in seconds, re-issue IDLE after this
+IMAP_FETCH_LIMIT = int(os.getenv('IMAP_FETCH_LIMIT', '65536'))  # bytes fetched per message
+EMAIL_CHECK_DELIVERABILITY = os.getenv('EMAIL_CHECK_DELIVERABILITY', 'true').lower() == 'true'  # DNS lookup of sender domains
+EMAIL_VALIDATION_CACHE_SIZE = int(os.getenv('EMAIL_VALIDATION_CACHE_SIZE', '4096'))  # validated addresses kept
 SMTP_SERVER = os.getenv('SMTP_SERVER')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'  # false for local relays without TLS
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '4'))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+SMTP_IDLE_TIMEOUT = int(os.getenv('SMTP_IDLE_TIMEOUT', '60'))  # in seconds
 
 # Database configuration
 DB_TYPE = os.getenv('DB_TYPE', 'postgresql')
@@ -40,11 +69,54 @@ DB_PORT = os.getenv('DB_PORT', '5432')
 DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))  # connections kept open
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))  # extra connections opened under load
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # in seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # in seconds, -1 keeps connections forever
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'  # test connections on checkout
 
 # Application configuration
 URL = os.getenv('URL')
+SOURCES = os.getenv('SOURCES')  # comma-separated id=url pairs, defaults to URL as source 'default'
+DEFAULT_SOURCE = os.getenv('DEFAULT_SOURCE', 'default')  # source of clients that don't name a school
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', '8'))  # sources fetched at the same time
+FETCH_PER_HOST_LIMIT = int(os.getenv('FETCH_PER_HOST_LIMIT', '2'))  # concurrent requests to one host
+SOURCE_MAX_SKIPPED_CHECKS = int(os.getenv('SOURCE_MAX_SKIPPED_CHECKS', '12'))  # backoff cap for failing sources
 CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', '5'))  # in minutes
 EMAIL_CHECK_INTERVAL = int(os.getenv('EMAIL_CHECK_INTERVAL', '1'))  # in minutes
+HTTP_TIMEOUT = int(os.getenv('HTTP_TIMEOUT', '30'))  # in seconds
+HTML_PARSER = os.getenv('HTML_PARSER', 'stream')  # stream, lxml or bs4
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '256'))  # rendered batches kept
+DATE_CACHE_SIZE = int(os.getenv('DATE_CACHE_SIZE', '1024'))  # parsed date captions kept
+DATE_ERROR_LOG_INTERVAL = int(os.getenv('DATE_ERROR_LOG_INTERVAL', '3600'))  # in seconds, per unparsable caption
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR')  # archives every fetched page here for replays, unset to disable
+SNAPSHOT_COMPRESSION = os.getenv('SNAPSHOT_COMPRESSION', 'gzip')  # gzip or zstd (requires `pip install zstandard`)
+
+# Notification dispatch configuration
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '4'))
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', '3'))
+NOTIFY_RETRY_BACKOFF = float(os.getenv('NOTIFY_RETRY_BACKOFF', '2'))  # in seconds, doubled per attempt
+SMTP_RATE_LIMIT = float(os.getenv('SMTP_RATE_LIMIT', '5'))  # messages per second
+SMTP_RATE_BURST = int(os.getenv('SMTP_RATE_BURST', '10'))
+NOTIFY_DIGEST_WINDOW = int(os.getenv('NOTIFY_DIGEST_WINDOW', '120'))  # in seconds, 0 sends every change right away
+
+# Retention configuration
+SCHEDULE_RETENTION_DAYS = int(os.getenv('SCHEDULE_RETENTION_DAYS', '180'))  # older dates are deleted, 0 keeps everything
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '24'))  # in hours
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))  # rows per delete statement
+SCHEDULE_PARTITIONING = os.getenv('SCHEDULE_PARTITIONING', 'false').lower() == 'true'  # monthly partitions, PostgreSQL only
+SCHEDULE_PARTITIONS_AHEAD = int(os.getenv('SCHEDULE_PARTITIONS_AHEAD', '2'))  # months created in advance
+
+# Replica coordination configuration
+LEADER_ELECTION = os.getenv('LEADER_ELECTION', 'true').lower() == 'true'  # false: every process scrapes
+LEADER_LOCK_FILE = os.getenv('LEADER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'stand_in_notifier.lock'))  # used without PostgreSQL
+
+# Notification outbox configuration
+OUTBOX_POLL_INTERVAL = int(os.getenv('OUTBOX_POLL_INTERVAL', '5'))  # in seconds
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '500'))  # due rows claimed per run
+OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', '300'))  # in seconds a claim is held before others may retry it
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BACKOFF = int(os.getenv('OUTBOX_RETRY_BACKOFF', '30'))  # in seconds, doubled per attempt
 
 # Telegram configuration (if used)
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -53,28 +125,284 @@ TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 # Discord configuration (if used)
 DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL')
 
+# Observability configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG also logs every changed entry and sent email
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # serves /metrics, 0 to disable
+
 # ---------------------------------------
 # Logging Configuration
 # ---------------------------------------
 
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOG_LEVEL.upper(),
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler()]
 )
 
+# ---------------------------------------
+# Metrics
+# ---------------------------------------
+
+# Every metric registers itself here, in exposition order
+metrics_registry = []
+
+def format_labels(names, values, extra=()):
+    """Renders a Prometheus label set such as {operation="parse_html",le="0.1"}."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Returns the count with the given labels."""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            return [f'{self.name}{format_labels(self.labelnames, key)} {value}' for key, value in self._values.items()]
+
+class Gauge:
+    """Value read from a callback whenever the metrics are scraped."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+        metrics_registry.append(self)
+
+    def samples(self):
+        return [f'{self.name} {self.function()}']
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values, optionally split by labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, value, **labels):
+        self.observe_series(tuple(labels[name] for name in self.labelnames), value)
+
+    def observe_series(self, key, value):
+        """Observes a value for a tuple of label values in labelnames order."""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Counts per bucket plus one for values above the last bound, then the sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def total(self, **labels):
+        """Returns the sum of the values observed with the given labels."""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return series[1] if series else 0.0
+
+    def timer(self, **labels):
+        """Returns a Timer observing durations with the given labels."""
+        return Timer(self, tuple(labels[name] for name in self.labelnames))
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", bound)])} {cumulative}')
+                lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+class Timer:
+    """Observes the duration of a block in a histogram; also usable as a decorator.
+
+    Cheaper than a generator-based context manager, as it also wraps
+    functions called on every row.
+    """
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe_series(self.key, time.perf_counter() - self._start)
+
+    def __call__(self, func):
+        histogram = self.histogram
+        key = self.key
+
+        @functools.wraps(func)
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe_series(key, time.perf_counter() - start)
+        return timed_call
+
+operation_seconds = Histogram(
+    'stand_in_operation_seconds', "Duration of hot-path operations.", ('operation',)
+)
+polls_total = Counter('stand_in_polls_total', "Source polls by outcome.", ('status',))
+rows_parsed_total = Counter('stand_in_rows_parsed_total', "Schedule rows parsed from fetched pages.", ('source',))
+rows_changed_total = Counter('stand_in_rows_changed_total', "Schedule rows committed as changed.", ('change',))
+emails_total = Counter('stand_in_emails_total', "Outgoing emails by result.", ('result',))
+rows_purged_total = Counter('stand_in_rows_purged_total', "Rows deleted by the retention job.", ('table',))
+Gauge('stand_in_subscribers', "Registered clients in the subscriber index.", lambda: subscriber_index.stats()['clients'])
+Gauge('stand_in_dispatch_queue_depth', "Notifications waiting in the dispatcher queue.", lambda: dispatcher.stats()['queue_depth'])
+Gauge('stand_in_scrape_leader', "1 if this replica is the scrape leader.", lambda: int(scrape_leader.leader))
+Gauge('stand_in_inbox_leader', "1 if this replica is the inbox leader.", lambda: int(inbox_leader.leader))
+
+def timed(operation):
+    """Times a block or, as a decorator, every call of a function under the given operation label."""
+    return operation_seconds.timer(operation=operation)
+
+def render_metrics():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        try:
+            lines.extend(metric.samples())
+        except Exception as e:
+            logging.error(f"Error collecting metric {metric.name}: {e}")
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves render_metrics() on GET /metrics."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port):
+    """Serves /metrics on a daemon thread and returns the server, or None if the port is taken."""
+    try:
+        server = ThreadingHTTPServer(('', port), MetricsHandler)
+    except OSError as e:
+        logging.error(f"Could not serve metrics on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on port {port}.")
+    return server
+
 # ---------------------------------------
 # Database Setup
 # ---------------------------------------
 
-# Construct the database URL
-DATABASE_URL = f"{DB_TYPE}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Construct the database URL, unless a full one is given (e.g. sqlite:///stand_in.db)
+DATABASE_URL = os.getenv('DATABASE_URL') or f"{DB_TYPE}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+pool_checkout_seconds = Histogram(
+    'stand_in_db_pool_checkout_seconds', "Time spent waiting for a pooled database connection, including connecting."
+)
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start)
+
+# The engine is created on first use, so importing this module (e.g. from clear_day.py) doesn't connect
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Returns the shared engine, creating it with the configured pool settings on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                options = {'pool_pre_ping': DB_POOL_PRE_PING}
+                if make_url(DATABASE_URL).database not in (None, '', ':memory:'):
+                    options.update(
+                        poolclass=TimedQueuePool,
+                        pool_size=DB_POOL_SIZE,
+                        max_overflow=DB_MAX_OVERFLOW,
+                        pool_timeout=DB_POOL_TIMEOUT,
+                        pool_recycle=DB_POOL_RECYCLE,
+                    )
+                _engine = create_engine(DATABASE_URL, **options)
+    return _engine
+
+session_factory = sessionmaker(autocommit=False, autoflush=False)
+
+def SessionLocal():
+    """Returns a new session bound to the shared engine."""
+    return session_factory(bind=get_engine())
+
+@contextmanager
+def session_scope():
+    """Provides a session that commits when the block succeeds, rolls back when it raises and is always closed."""
+    session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
-# Create the engine
-engine = create_engine(DATABASE_URL)
+Gauge(
+    'stand_in_db_pool_checked_out', "Database connections currently checked out of the pool.",
+    lambda: _engine.pool.checkedout() if isinstance(getattr(_engine, 'pool', None), QueuePool) else 0
+)
 
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Native range partitioning by month only exists on PostgreSQL
+SCHEDULE_PARTITIONED = SCHEDULE_PARTITIONING and make_url(DATABASE_URL).get_backend_name() == 'postgresql'
 
 # Base class for declarative models
 Base = declarative_base()
@@ -83,10 +411,18 @@ Base = declarative_base()
 # Database Models
 # ---------------------------------------
 
+class Source(Base):
+    __tablename__ = 'sources'
+    id = Column(String, primary_key=True)
+    url = Column(String, nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+
 class ScheduleEntry(Base):
     __tablename__ = 'schedule_entries'
-    id = Column(Integer, primary_key=True, index=True)
-    date = Column(Date, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    source_id = Column(String, nullable=False, server_default=DEFAULT_SOURCE)
+    # The primary key of a partitioned table has to include the partition key
+    date = Column(Date, index=True, primary_key=SCHEDULE_PARTITIONED)
     stand_in_teacher = Column(String)
     lesson = Column(String)
     class_name = Column(String, index=True)
@@ -94,8 +430,11 @@ class ScheduleEntry(Base):
     room = Column(String)
     missing_teacher = Column(String)
     comment = Column(String)
+    fingerprint = Column(String)
+    removed_at = Column(DateTime)
     __table_args__ = (
-        UniqueConstraint('date', 'lesson', 'class_name', 'missing_teacher', name='_schedule_uc'),
+        UniqueConstraint('source_id', 'date', 'lesson', 'class_name', 'missing_teacher', name='_schedule_uc'),
+        {'postgresql_partition_by': 'RANGE (date)'} if SCHEDULE_PARTITIONED else {},
     )
 
 class Client(Base):
@@ -105,20 +444,747 @@ class Client(Base):
     name = Column(String)
     class_name = Column(String)
     language = Column(String)
+    source_id = Column(String, nullable=False, server_default=DEFAULT_SOURCE)
+
+class SubscriptionRule(Base):
+    __tablename__ = 'subscription_rules'
+    id = Column(Integer, primary_key=True)
+    client_email = Column(String, nullable=False, index=True)
+    kind = Column(String, nullable=False)  # include or exclude
+    field = Column(String, nullable=False)  # class, teacher or subject
+    value = Column(String, nullable=False)
+    __table_args__ = (
+        UniqueConstraint('client_email', 'kind', 'field', 'value', name='_subscription_rule_uc'),
+    )
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    id = Column(Integer, primary_key=True)
+    client_email = Column(String, nullable=False)
+    entry_id = Column(Integer, nullable=False)
+    fingerprint = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_until = Column(DateTime)
+    sent_at = Column(DateTime)
+    last_error = Column(String)
+    __table_args__ = (
+        # Only unsent rows are deduplicated, so a change that comes back after it was sent is queued again
+        Index(
+            '_outbox_pending_uc', 'client_email', 'entry_id', 'fingerprint', 'status', unique=True,
+            postgresql_where=sent_at.is_(None), sqlite_where=sent_at.is_(None)
+        ),
+    )
+
+class FetchState(Base):
+    __tablename__ = 'fetch_state'
+    url = Column(String, primary_key=True)
+    etag = Column(String)
+    last_modified = Column(String)
+    content_hash = Column(String)
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, nullable=False)
+
+class ChangeCounter(Base):
+    __tablename__ = 'change_counters'
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
 
 def init_db():
-    """Initializes the database by creating tables."""
-    Base.metadata.create_all(bind=engine)
+    """Migrates the database to the newest schema version, one replica at a time.
+
+    A database that is already current costs a single query, so restarts
+    and added workers don't introspect the schema.
+    """
+    engine = get_engine()
+    if schema_version(engine) >= MIGRATIONS[-1][0]:
+        logging.info("Database schema is current.")
+        return
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': advisory_lock_key('migrations')})
+        try:
+            # Another replica may have migrated while this one waited for the lock
+            current = schema_version(engine)
+            for version, migration in MIGRATIONS:
+                if version <= current:
+                    continue
+                migration()
+                with session_scope() as session:
+                    session.add(SchemaMigration(version=version, applied_at=datetime.now()))
+                logging.info(f"Migrated the database to schema version {version} ({migration.__name__}).")
+        finally:
+            if engine.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': advisory_lock_key('migrations')})
     logging.info("Database initialized.")
 
+def schema_version(engine):
+    """Returns the newest applied migration, 0 for a database that predates schema_migrations."""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return 0
+
+def migrate_baseline():
+    """Creates missing tables and brings tables of older versions up to the models."""
+    Base.metadata.create_all(bind=get_engine())
+    add_missing_columns()
+    upgrade_schedule_constraint()
+    if SCHEDULE_PARTITIONED:
+        ensure_schedule_partitions()
+
+def advisory_lock_key(name):
+    """Maps a lock name to a signed 64-bit PostgreSQL advisory lock key."""
+    return int.from_bytes(hashlib.blake2b(f'stand_in_notifier:{name}'.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+def add_missing_columns():
+    """Adds model columns that are missing from tables created by an older version."""
+    engine = get_engine()
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}'
+                    if column.server_default is not None:
+                        ddl += f" DEFAULT '{column.server_default.arg}'"
+                        if not column.nullable:
+                            ddl += ' NOT NULL'
+                    connection.execute(text(ddl))
+                    logging.info(f"Added column {table.name}.{column.name}.")
+
+def upgrade_schedule_constraint():
+    """Adds source_id to the _schedule_uc constraint of tables created before multi-source scraping."""
+    engine = get_engine()
+    for constraint in inspect(engine).get_unique_constraints('schedule_entries'):
+        if constraint['name'] != '_schedule_uc' or 'source_id' in constraint['column_names']:
+            continue
+        if engine.dialect.name != 'postgresql':
+            # SQLite can't alter constraints, but a unique index is a valid ON CONFLICT target
+            with engine.begin() as connection:
+                connection.execute(text(
+                    'CREATE UNIQUE INDEX IF NOT EXISTS _schedule_source_uc '
+                    'ON schedule_entries (source_id, date, lesson, class_name, missing_teacher)'
+                ))
+            logging.warning("schedule_entries._schedule_uc lacks source_id; recreate the table to scrape several sources.")
+            return
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE schedule_entries DROP CONSTRAINT _schedule_uc, '
+                'ADD CONSTRAINT _schedule_uc UNIQUE (source_id, date, lesson, class_name, missing_teacher)'
+            ))
+        logging.info("Added source_id to schedule_entries._schedule_uc.")
+
+def configured_sources():
+    """Returns the {source_id: url} map given by SOURCES, or URL as the default source."""
+    if not SOURCES:
+        return {DEFAULT_SOURCE: URL} if URL else {}
+    sources = {}
+    for pair in SOURCES.split(','):
+        source_id, _, url = pair.strip().partition('=')
+        if source_id and url:
+            sources[source_id.strip()] = url.strip()
+        else:
+            logging.error(f"Ignoring malformed SOURCES entry: {pair!r}")
+    return sources
+
+def migrate_outbox_pending_index():
+    """Replaces the _outbox_uc constraint, which also matched sent rows, with the _outbox_pending_uc index."""
+    engine = get_engine()
+    constraints = {constraint['name'] for constraint in inspect(engine).get_unique_constraints('outbox')}
+    if '_outbox_uc' in constraints:
+        if engine.dialect.name == 'postgresql':
+            with engine.begin() as connection:
+                connection.execute(text('ALTER TABLE outbox DROP CONSTRAINT _outbox_uc'))
+        else:
+            # SQLite can't drop a constraint, so the rows are copied into the table as the model creates it
+            columns = ', '.join(column.name for column in OutboxMessage.__table__.columns)
+            with engine.begin() as connection:
+                connection.execute(text('CREATE TABLE outbox_old AS SELECT * FROM outbox'))
+                connection.execute(text('DROP TABLE outbox'))
+                OutboxMessage.__table__.create(connection)
+                connection.execute(text(f'INSERT INTO outbox ({columns}) SELECT {columns} FROM outbox_old'))
+                connection.execute(text('DROP TABLE outbox_old'))
+        logging.info("Replaced outbox._outbox_uc with a unique index over unsent rows.")
+    for index in OutboxMessage.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+def migrate_change_counters():
+    """Creates the change_counters table."""
+    Base.metadata.create_all(bind=get_engine(), tables=[ChangeCounter.__table__])
+
+# Schema versions and the migrations that reach them, in order. Append a migration for every model
+# change; the baseline already brings any older table up to the current models.
+MIGRATIONS = [
+    (1, migrate_baseline),
+    (2, migrate_outbox_pending_index),
+    (3, migrate_change_counters),
+]
+
+# Source of the clients and entries stored while a single URL was scraped
+LEGACY_SOURCE = 'default'
+
+def register_sources():
+    """Creates or updates the configured sources; sources added directly in the database are kept.
+
+    Once LEGACY_SOURCE is no longer configured, e.g. after switching from URL
+    to SOURCES or setting DEFAULT_SOURCE, its clients and entries move to
+    DEFAULT_SOURCE.
+    """
+    sources = configured_sources()
+    with session_scope() as session:
+        for source_id, url in sources.items():
+            session.merge(Source(id=source_id, url=url, enabled=True))
+        if LEGACY_SOURCE not in sources and DEFAULT_SOURCE in sources:
+            adopt_legacy_source(session, DEFAULT_SOURCE)
+        session.flush()
+        report_unscraped_sources(session)
+
+def adopt_legacy_source(session, source_id):
+    """Moves the clients and schedule entries of LEGACY_SOURCE to source_id and disables LEGACY_SOURCE.
+
+    Entries that source_id already has are dropped instead of moved.
+    """
+    clients = session.execute(
+        update(Client).where(Client.source_id == LEGACY_SOURCE).values(source_id=source_id)
+    ).rowcount
+    if clients:
+        count_change(session, SUBSCRIBER_CHANGES)
+    current = aliased(ScheduleEntry)
+    entries = session.execute(
+        update(ScheduleEntry)
+        .where(
+            ScheduleEntry.source_id == LEGACY_SOURCE,
+            ~select(current.id).where(
+                current.source_id == source_id,
+                *(getattr(current, column) == getattr(ScheduleEntry, column) for column in SCHEDULE_KEY_COLUMNS[1:])
+            ).exists()
+        )
+        .values(source_id=source_id)
+    ).rowcount
+    dropped = session.execute(delete(ScheduleEntry).where(ScheduleEntry.source_id == LEGACY_SOURCE)).rowcount
+    session.execute(update(Source).where(Source.id == LEGACY_SOURCE).values(enabled=False))
+    if clients or entries or dropped:
+        logging.warning(
+            f"Moved {clients} clients and {entries} schedule entries of source '{LEGACY_SOURCE}' to '{source_id}'"
+            f" ({dropped} entries it already had were dropped)."
+        )
+
+def report_unscraped_sources(session):
+    """Logs an error for DEFAULT_SOURCE and every source clients are registered with that isn't enabled."""
+    enabled = set(session.scalars(select(Source.id).where(Source.enabled.is_(True))))
+    if DEFAULT_SOURCE not in enabled:
+        logging.error(f"DEFAULT_SOURCE '{DEFAULT_SOURCE}' is not enabled, so START commands need a 'School:' line.")
+    for source_id, count in session.execute(
+        select(Client.source_id, func.count()).where(Client.source_id.not_in(enabled)).group_by(Client.source_id)
+    ):
+        logging.error(f"{count} clients are registered with source '{source_id}', which is not enabled; they get no notifications.")
+
+# ---------------------------------------
+# Schedule Storage
+# ---------------------------------------
+
+# Columns that identify an entry (the _schedule_uc constraint) and the ones refreshed on update
+SCHEDULE_KEY_COLUMNS = ('source_id', 'date', 'lesson', 'class_name', 'missing_teacher')
+SCHEDULE_UPDATE_COLUMNS = ('stand_in_teacher', 'subject', 'room', 'comment', 'fingerprint', 'removed_at')
+
+# The seven scraped fields as stored, in table cell order
+SCHEDULE_COLUMNS = ('stand_in_teacher', 'lesson', 'class_name', 'subject', 'room', 'missing_teacher', 'comment')
+
+# Dialect-specific INSERT constructs that support ON CONFLICT DO UPDATE ... RETURNING
+def upsert_insert(dialect_name):
+    """Returns the INSERT construct with ON CONFLICT support of a dialect, importing only that dialect."""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Upserts are not supported on {dialect_name}.")
+    return insert
+
+def schedule_key(entry):
+    """Returns the _schedule_uc tuple of a stored entry or a row dict."""
+    if isinstance(entry, dict):
+        return tuple(entry[column] for column in SCHEDULE_KEY_COLUMNS)
+    return tuple(getattr(entry, column) for column in SCHEDULE_KEY_COLUMNS)
+
+def schedule_fingerprint(entry):
+    """Returns a stable hash of the seven scraped fields of a stored entry or a row dict."""
+    if isinstance(entry, dict):
+        values = (entry[column] for column in SCHEDULE_COLUMNS)
+    else:
+        values = (getattr(entry, column) for column in SCHEDULE_COLUMNS)
+    payload = '\x1f'.join(value or '' for value in values)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+class ScheduleIndex:
+    """In-process map of active schedule keys to fingerprints, loaded once per source and date.
+
+    Before a cached date is used, its number of active rows is checked against
+    the database, so a date whose rows were deleted by another process, e.g.
+    clear_day.py, is loaded again.
+    """
+
+    def __init__(self):
+        self._dates = {}
+
+    def load(self, session, source_id, date_obj):
+        """Returns the {key: fingerprint} map of a source's date, querying the database on first use."""
+        conditions = (ScheduleEntry.source_id == source_id, ScheduleEntry.date == date_obj)
+        fingerprints = self._dates.get((source_id, date_obj))
+        if fingerprints is not None:
+            count = session.scalar(
+                select(func.count()).select_from(ScheduleEntry).where(*conditions, ScheduleEntry.removed_at.is_(None))
+            )
+            if count != len(fingerprints):
+                logging.info(f"Schedule index of {source_id} on {date_obj} is stale, reloading it.")
+                fingerprints = None
+        if fingerprints is None:
+            fingerprints = self._query(session, *conditions).get((source_id, date_obj), {})
+            self._dates[(source_id, date_obj)] = fingerprints
+        return fingerprints
+
+    def warm(self, session, since):
+        """Loads every date from since onwards with a single query."""
+        loaded = self._query(session, ScheduleEntry.date >= since)
+        self._dates.update(loaded)
+        logging.info(f"Schedule index warmed with {sum(map(len, loaded.values()))} entries on {len(loaded)} source dates.")
+
+    def update(self, entries):
+        """Records the fingerprints of committed entries."""
+        for entry in entries:
+            self._dates.setdefault((entry.source_id, entry.date), {})[schedule_key(entry)] = entry.fingerprint
+
+    def discard(self, entries):
+        """Forgets committed entries that were removed."""
+        for entry in entries:
+            self._dates.get((entry.source_id, entry.date), {}).pop(schedule_key(entry), None)
+
+    def forget(self, before):
+        """Drops every date before the given one, e.g. after the retention job deleted them."""
+        for key in [key for key in self._dates if key[1] < before]:
+            del self._dates[key]
+
+    def clear(self):
+        self._dates.clear()
+
+    def _query(self, session, *conditions):
+        columns = set(SCHEDULE_KEY_COLUMNS + SCHEDULE_COLUMNS + ('fingerprint',))
+        rows = session.execute(
+            select(*(getattr(ScheduleEntry, column) for column in columns))
+            .where(*conditions, ScheduleEntry.removed_at.is_(None))
+        )
+        dates = {}
+        for row in rows:
+            # Rows written before the fingerprint column existed are hashed on load
+            dates.setdefault((row.source_id, row.date), {})[schedule_key(row)] = row.fingerprint or schedule_fingerprint(row)
+        return dates
+
+schedule_index = ScheduleIndex()
+
+def warm_schedule_index():
+    """Loads the fingerprints of today's and future entries into the schedule index."""
+    session = SessionLocal()
+    try:
+        schedule_index.warm(session, datetime.now().date())
+    finally:
+        session.close()
+
+def schedule_rows(source_id, date_obj, entries):
+    """Converts scraped entries of a source's date into row dicts keyed by their _schedule_uc tuple."""
+    rows = {}
+    for entry_data in entries:
+        # Skip entries that have missing critical information
+        if not entry_data['lesson'] or not entry_data['class'] or not entry_data['missing_teacher']:
+            continue
+
+        row = {
+            'source_id': source_id,
+            'date': date_obj,
+            'stand_in_teacher': entry_data['stand_in_teacher'],
+            'lesson': entry_data['lesson'],
+            'class_name': entry_data['class'],
+            'subject': entry_data['subject'],
+            'room': entry_data['room'],
+            'missing_teacher': entry_data['missing_teacher'],
+            'comment': entry_data['comment'],
+            'removed_at': None,
+        }
+        row['fingerprint'] = schedule_fingerprint(row)
+        rows[schedule_key(row)] = row
+    return rows
+
+def upsert_schedule_entries(session, stored, rows):
+    """Writes the rows whose fingerprint differs from the stored one in one statement.
+
+    Returns the new and the updated entries as rows returned by the database.
+    A previously removed entry that reappears counts as new.
+    """
+    pending = []
+    new_keys = set()
+    for key, row in rows.items():
+        stored_fingerprint = stored.get(key)
+        if stored_fingerprint == row['fingerprint']:
+            continue
+        if stored_fingerprint is None:
+            new_keys.add(key)
+            logging.debug(f"New entry added: {row}")
+        else:
+            logging.debug(f"Entry updated: {row}")
+        pending.append(row)
+
+    if not pending:
+        return [], []
+
+    insert = upsert_insert(session.get_bind().dialect.name)
+    stmt = insert(ScheduleEntry).values(pending)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(SCHEDULE_KEY_COLUMNS),
+        set_={column: stmt.excluded[column] for column in SCHEDULE_UPDATE_COLUMNS}
+    ).returning(*ScheduleEntry.__table__.columns)
+
+    new_entries = []
+    updated_entries = []
+    for entry in session.execute(stmt):
+        (new_entries if schedule_key(entry) in new_keys else updated_entries).append(entry)
+    return new_entries, updated_entries
+
+def remove_schedule_entries(session, source_id, date_obj, keys):
+    """Soft-deletes the entries of a source's date with the given keys in one statement and returns them."""
+    if not keys:
+        return []
+
+    stmt = (
+        update(ScheduleEntry)
+        .where(
+            ScheduleEntry.source_id == source_id,
+            ScheduleEntry.date == date_obj,
+            ScheduleEntry.removed_at.is_(None),
+            tuple_(ScheduleEntry.lesson, ScheduleEntry.class_name, ScheduleEntry.missing_teacher).in_(
+                [(lesson, class_name, missing_teacher) for _, _, lesson, class_name, missing_teacher in keys]
+            )
+        )
+        .values(removed_at=datetime.now())
+        .returning(*ScheduleEntry.__table__.columns)
+    )
+    removed_entries = session.execute(stmt).all()
+    for entry in removed_entries:
+        logging.debug(f"Entry removed: {schedule_key(entry)}")
+    return removed_entries
+
+@timed('schedule_diff')
+def sync_schedule_date(session, source_id, date_obj, entries):
+    """Diffs the scraped entries of a source's date against the schedule index by key set and fingerprint.
+
+    Uses a constant number of statements per date. Returns the new, updated
+    and removed entries; the caller applies them to schedule_index once they
+    are committed.
+    """
+    stored = schedule_index.load(session, source_id, date_obj)
+    rows = schedule_rows(source_id, date_obj, entries)
+
+    new_entries, updated_entries = upsert_schedule_entries(session, stored, rows)
+    removed_entries = remove_schedule_entries(session, source_id, date_obj, stored.keys() - rows.keys())
+    return new_entries, updated_entries, removed_entries
+
+# ---------------------------------------
+# Subscriber Index
+# ---------------------------------------
+
+# Fields of a schedule entry that subscription rules match, by rule field
+RULE_FIELDS = {
+    'class': ('class_name',),
+    'teacher': ('missing_teacher', 'stand_in_teacher'),
+    'subject': ('subject',),
+}
+
+# Second languages by their English and Hungarian names, as in 'Language: English' or the subject 'angol nyelv'
+LANGUAGE_NAMES = {
+    'english': 'english', 'angol': 'english',
+    'german': 'german', 'német': 'german',
+    'french': 'french', 'francia': 'french',
+    'spanish': 'spanish', 'spanyol': 'spanish',
+    'italian': 'italian', 'olasz': 'italian',
+    'russian': 'russian', 'orosz': 'russian',
+    'latin': 'latin',
+    'chinese': 'chinese', 'kínai': 'chinese',
+    'japanese': 'japanese', 'japán': 'japanese',
+}
+
+# Change counter that every stored registration or removal increments
+SUBSCRIBER_CHANGES = 'subscribers'
+
+def count_change(session, name):
+    """Increments a change counter in the caller's transaction and returns its new value."""
+    insert = upsert_insert(session.get_bind().dialect.name)
+    stmt = insert(ChangeCounter).values(name=name, value=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'], set_={'value': ChangeCounter.value + 1}
+    ).returning(ChangeCounter.value)
+    return session.scalar(stmt)
+
+def change_count(session, name):
+    """Returns the value of a change counter, 0 if it was never incremented."""
+    return session.scalar(select(ChangeCounter.value).where(ChangeCounter.name == name)) or 0
+
+def rule_value(field, value):
+    """Normalizes a rule or entry value, so 'Nagy  Anna' matches 'nagy anna' and '10.be' matches '10.BE'."""
+    value = ' '.join((value or '').split())
+    return value.upper() if field == 'class' else value.casefold()
+
+def language_group(value):
+    """Returns the canonical second language named by a client's language or an entry's subject, or None."""
+    words = (value or '').casefold().split()
+    return LANGUAGE_NAMES.get(words[0]) if words else None
+
+class Subscriber:
+    """Lightweight, session-independent copy of a Client row and its subscription rules."""
+    __slots__ = ('email', 'name', 'class_name', 'language', 'source_id', 'rules')
+
+    def __init__(self, email, name, class_name, language, source_id, rules=()):
+        self.email = email
+        self.name = name
+        self.class_name = class_name
+        self.language = language
+        self.source_id = source_id
+        self.rules = tuple(rules)
+
+    def index_keys(self):
+        """Returns the (kind, (source_id, field, value)) postings of this subscriber.
+
+        The class the client registered with is an implicit include rule, so
+        clients without stored rules keep receiving their class.
+        """
+        keys = [('include', (self.source_id, 'class', rule_value('class', self.class_name)))]
+        for kind, field, value in self.rules:
+            keys.append((kind, (self.source_id, field, rule_value(field, value))))
+        return keys
+
+class SubscriberIndex:
+    """Inverted index of subscription rules, loaded from the database once and updated incrementally.
+
+    Include and exclude rules are compiled into {(source_id, field, value):
+    set of emails} maps, so the recipients of an entry are found with a few
+    set operations, however many subscribers and rules there are. An entry
+    reaches the clients that include its class, a teacher of it or its
+    subject, minus the clients that exclude any of those. Clients who only
+    match by class don't get lessons of another second language than theirs.
+    """
+
+    def __init__(self):
+        self._by_email = {}
+        self._postings = {'include': {}, 'exclude': {}}
+        self._languages = {}  # (source_id, language) -> emails
+        self._with_language = {}  # source_id -> emails of clients in a language group
+        self._loaded = False
+        self._version = None  # value of the SUBSCRIBER_CHANGES counter the index reflects
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Loads all clients and their rules with two queries."""
+        session = SessionLocal()
+        try:
+            # Read first, so a change committed while loading triggers another load
+            version = change_count(session, SUBSCRIBER_CHANGES)
+            clients = session.query(
+                Client.email, Client.name, Client.class_name, Client.language, Client.source_id
+            ).all()
+            rules = load_subscription_rules(session)
+        finally:
+            session.close()
+
+        with self._lock:
+            self._by_email = {}
+            self._postings = {'include': {}, 'exclude': {}}
+            self._languages = {}
+            self._with_language = {}
+            for client in clients:
+                self._add(Subscriber(
+                    client.email, client.name, client.class_name, client.language, client.source_id,
+                    rules.get(client.email, ())
+                ))
+            self._loaded = True
+            self._version = version
+        logging.info(f"Subscriber index loaded with {len(clients)} clients and {sum(map(len, rules.values()))} rules.")
+
+    def refresh(self):
+        """Loads the index unless it is loaded and no process stored client changes since.
+
+        Changes stored by this process are applied incrementally, so a check
+        costs one query until another replica stores some.
+        """
+        if self._loaded:
+            with SessionLocal() as session:
+                version = change_count(session, SUBSCRIBER_CHANGES)
+            if version == self._version:
+                return
+        self.load()
+
+    def applied(self, version):
+        """Records that the client changes counted as version were applied with upsert() and remove()."""
+        with self._lock:
+            # A gap means another process stored changes too, which only a load picks up
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def resolve(self, entries):
+        """Returns the set of recipient emails of every entry, in order.
+
+        Entries with the same source, class, subject and teachers share one
+        lookup, as most entries of a batch differ only in lesson and room.
+        """
+        if not self._loaded:
+            self.load()
+        include = self._postings['include']
+        exclude = self._postings['exclude']
+        empty = frozenset()
+        resolved = {}
+        recipients = []
+        with self._lock:
+            for entry in entries:
+                signature = (entry.source_id, entry.class_name, entry.subject, entry.missing_teacher, entry.stand_in_teacher)
+                emails = resolved.get(signature)
+                if emails is None:
+                    keys = [
+                        (entry.source_id, field, rule_value(field, getattr(entry, column)))
+                        for field, columns in RULE_FIELDS.items() for column in columns
+                    ]
+                    emails = set(include.get(keys[0], empty))
+                    language = language_group(entry.subject)
+                    if language is not None and emails:
+                        # Students of the class who study another language
+                        emails -= self._with_language.get(entry.source_id, empty) - self._languages.get((entry.source_id, language), empty)
+                    for key in keys[1:]:
+                        emails |= include.get(key, empty)
+                    for key in keys:
+                        emails -= exclude.get(key, empty)
+                    resolved[signature] = emails
+                    if emails:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                recipients.append(emails)
+        return recipients
+
+    def lookup_emails(self, emails):
+        """Returns the subset of emails that belong to current subscribers.
+
+        Emails missing from the index are looked up in the database, since
+        another replica may have registered them. A process that never loads
+        the index, such as a deliver-only worker, looks up every email there.
+        """
+        with self._lock:
+            found = {email for email in emails if email in self._by_email}
+        missing = set(emails) - found
+        if not missing:
+            return found
+
+        session = SessionLocal()
+        try:
+            clients = session.query(
+                Client.email, Client.name, Client.class_name, Client.language, Client.source_id
+            ).filter(Client.email.in_(missing)).all()
+            rules = load_subscription_rules(session, missing)
+        finally:
+            session.close()
+        for client in clients:
+            self.upsert(
+                client.email, client.name, client.class_name, client.language, client.source_id,
+                rules.get(client.email, ())
+            )
+            found.add(client.email)
+        return found
+
+    def upsert(self, email, name, class_name, language, source_id, rules=()):
+        """Adds or replaces a subscriber and its (kind, field, value) rules after they were committed."""
+        with self._lock:
+            if self._loaded:
+                self._remove(email)
+                self._add(Subscriber(email, name, class_name, language, source_id, rules))
+
+    def remove(self, email):
+        """Drops a subscriber after its removal was committed."""
+        with self._lock:
+            if self._loaded:
+                self._remove(email)
+
+    def stats(self):
+        """Returns the index size and lookup hit/miss counts."""
+        with self._lock:
+            return {
+                'clients': len(self._by_email),
+                'keys': len(self._postings['include']) + len(self._postings['exclude']),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _add(self, subscriber):
+        self._by_email[subscriber.email] = subscriber
+        for kind, key in subscriber.index_keys():
+            self._postings[kind].setdefault(key, set()).add(subscriber.email)
+        language = language_group(subscriber.language)
+        if language is not None:
+            self._languages.setdefault((subscriber.source_id, language), set()).add(subscriber.email)
+            self._with_language.setdefault(subscriber.source_id, set()).add(subscriber.email)
+
+    def _remove(self, email):
+        subscriber = self._by_email.pop(email, None)
+        if subscriber is None:
+            return
+        for kind, key in subscriber.index_keys():
+            self._discard(self._postings[kind], key, email)
+        language = language_group(subscriber.language)
+        if language is not None:
+            self._discard(self._languages, (subscriber.source_id, language), email)
+            self._discard(self._with_language, subscriber.source_id, email)
+
+    @staticmethod
+    def _discard(postings, key, email):
+        emails = postings.get(key)
+        if emails is not None:
+            emails.discard(email)
+            if not emails:
+                del postings[key]
+
+def load_subscription_rules(session, emails=None):
+    """Returns {email: [(kind, field, value)]} of all clients, or of the given emails."""
+    query = session.query(
+        SubscriptionRule.client_email, SubscriptionRule.kind, SubscriptionRule.field, SubscriptionRule.value
+    )
+    if emails is not None:
+        query = query.filter(SubscriptionRule.client_email.in_(emails))
+    rules = {}
+    for rule in query:
+        rules.setdefault(rule.client_email, []).append((rule.kind, rule.field, rule.value))
+    return rules
+
+subscriber_index = SubscriberIndex()
+
 # ---------------------------------------
 # Utility Functions
 # ---------------------------------------
 
+@functools.lru_cache(maxsize=EMAIL_VALIDATION_CACHE_SIZE)
 def validate_email_address(email_address):
-    """Validates an email address."""
+    """Validates an email address and returns its normalized form, or None if it is invalid.
+
+    Results are memoized, because the deliverability check costs a DNS
+    lookup and the same parents write again and again.
+    """
+    from email_validator import validate_email, EmailNotValidError
+
     try:
-        valid = validate_email(email_address)
+        valid = validate_email(email_address, check_deliverability=EMAIL_CHECK_DELIVERABILITY)
         return valid.email
     except EmailNotValidError as e:
         logging.error(f"Invalid email address: {email_address} - {e}")
@@ -128,25 +1194,99 @@ def validate_email_address(email_address):
 # Web Scraper
 # ---------------------------------------
 
-def fetch_webpage(url):
-    """Fetches the webpage content."""
+# Shared HTTP session so polls reuse the keep-alive connection, one per concurrently fetched source
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Returns the shared HTTP session, creating it on the first poll so other roles never import requests."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+                session.mount('http://', HTTPAdapter(pool_maxsize=FETCH_CONCURRENCY))
+                session.mount('https://', HTTPAdapter(pool_maxsize=FETCH_CONCURRENCY))
+                _http_session = session
+    return _http_session
+
+# Poll outcomes, so the savings of conditional fetching are visible
+poll_stats = {'changed': 0, 'not_modified': 0, 'unchanged': 0, 'failed': 0}
+poll_stats_lock = threading.Lock()
+
+class FetchResult:
+    """Outcome of a conditional fetch: 'changed', 'not_modified', 'unchanged' or 'failed'."""
+    __slots__ = ('status', 'html', 'etag', 'last_modified', 'content_hash')
+
+    def __init__(self, status, html=None, etag=None, last_modified=None, content_hash=None):
+        self.status = status
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+
+@timed('fetch_if_changed')
+def fetch_if_changed(url, state=None):
+    """Fetches the webpage, revalidating with the stored FetchState and comparing content hashes."""
+    import requests
+
     try:
-        response = requests.get(url)
+        response = get_http_session().get(url, headers=conditional_headers(state), timeout=HTTP_TIMEOUT)
+        if response.status_code == 304:
+            logging.info(f"Webpage not modified: {url}")
+            return FetchResult('not_modified')
         response.raise_for_status()
-        logging.info(f"Fetched webpage: {url}")
-        return response.text
     except requests.RequestException as e:
         logging.error(f"Error fetching webpage: {e}")
-        return None
+        return FetchResult('failed')
+
+    result = hash_fetched_body(url, state, response.content, response.headers)
+    if result.status == 'changed':
+        result.html = response.text
+    return result
+
+def conditional_headers(state):
+    """Returns the revalidation headers for a stored FetchState."""
+    headers = {}
+    if state is not None:
+        if state.etag:
+            headers['If-None-Match'] = state.etag
+        if state.last_modified:
+            headers['If-Modified-Since'] = state.last_modified
+    return headers
+
+def hash_fetched_body(url, state, body, headers):
+    """Builds the FetchResult of a 200 response, marking it 'unchanged' if the body hash matches the stored one."""
+    content_hash = hashlib.sha256(body).hexdigest()
+    result = FetchResult(
+        'changed',
+        etag=headers.get('ETag'),
+        last_modified=headers.get('Last-Modified'),
+        content_hash=content_hash
+    )
+    if state is not None and state.content_hash == content_hash:
+        logging.info(f"Webpage content unchanged: {url}")
+        result.status = 'unchanged'
+    else:
+        logging.info(f"Fetched webpage: {url}")
+    return result
+
+# Fields of a schedule row, in the order of the seven table cells
+SCHEDULE_FIELDS = ('stand_in_teacher', 'lesson', 'class', 'subject', 'room', 'missing_teacher', 'comment')
+
+def parse_html_bs4(html):
+    """Parses the schedule tables with BeautifulSoup and the html.parser backend."""
+    from bs4 import BeautifulSoup
 
-def parse_html(html):
-    """Parses the HTML content and extracts schedule data."""
     soup = BeautifulSoup(html, 'html.parser')
     schedules = {}
 
     for table in soup.find_all('table', class_='live'):
-        date_caption = table.caption.get_text(strip=True)
-        date = date_caption.split(',')[0]  # Extract the date
+        date = table.caption.get_text(strip=True)
 
         schedule = []
         tbody = table.find('tbody')
@@ -154,72 +1294,609 @@ def parse_html(html):
         for row in tbody.find_all('tr'):
             cells = row.find_all('td')
             if cells and len(cells) == 7:
-                entry = {
-                    'stand_in_teacher': cells[0].get_text(strip=True),
-                    'lesson': cells[1].get_text(strip=True),
-                    'class': cells[2].get_text(strip=True),
-                    'subject': cells[3].get_text(strip=True),
-                    'room': cells[4].get_text(strip=True),
-                    'missing_teacher': cells[5].get_text(strip=True),
-                    'comment': cells[6].get_text(strip=True),
-                }
+                entry = dict(zip(SCHEDULE_FIELDS, (cell.get_text(strip=True) for cell in cells)))
                 schedule.append(entry)
 
         schedules[date] = schedule
 
+    return schedules
+
+def parse_html_lxml(html):
+    """Parses the schedule tables with lxml, which builds its tree in C."""
+    import lxml.html
+
+    def text(element):
+        return ''.join(part.strip() for part in element.itertext())
+
+    root = lxml.html.fromstring(html)
+    schedules = {}
+
+    for table in root.xpath("//table[contains(concat(' ', normalize-space(@class), ' '), ' live ')]"):
+        caption = table.find('.//caption')
+        date = text(caption)
+
+        schedule = []
+        tbody = table.find('.//tbody')
+
+        for row in tbody.iter('tr'):
+            cells = list(row.iter('td'))
+            if len(cells) == 7:
+                schedule.append(dict(zip(SCHEDULE_FIELDS, (text(cell) for cell in cells))))
+
+        schedules[date] = schedule
+
+    return schedules
+
+class ScheduleTableParser(HTMLParser):
+    """Streams through the page and collects table.live captions and 7-cell rows without building a tree."""
+
+    def __init__(self):
+        super().__init__()
+        self.schedules = {}
+        self._tables = []  # one flag per open table: True if it is a table.live
+        self._caption = None
+        self._date = None
+        self._schedule = None
+        self._in_tbody = False
+        self._cells = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            is_live = 'live' in (dict(attrs).get('class') or '').split()
+            self._tables.append(is_live)
+            if is_live and not any(self._tables[:-1]):
+                self._date = None
+                self._schedule = []
+            return
+        if self._schedule is None:
+            return
+        if tag == 'caption' and self._date is None and self._caption is None:
+            self._caption = []
+        elif tag == 'tbody':
+            self._in_tbody = True
+        elif tag == 'tr' and self._in_tbody and self._cells is None:
+            self._cells = []
+        elif tag == 'td' and self._cells is not None:
+            self._cell = []
+            self._cells.append(self._cell)
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self._tables:
+            self._tables.pop()
+            if self._schedule is not None and not any(self._tables):
+                self.schedules[self._date or ''] = self._schedule
+                self._schedule = None
+                self._in_tbody = False
+            return
+        if self._schedule is None:
+            return
+        if tag == 'caption' and self._caption is not None:
+            self._date = ''.join(self._caption)
+            self._caption = None
+        elif tag == 'tbody':
+            self._in_tbody = False
+        elif tag == 'tr' and self._cells is not None:
+            if len(self._cells) == 7:
+                self._schedule.append(dict(zip(SCHEDULE_FIELDS, (''.join(cell) for cell in self._cells))))
+            self._cells = None
+            self._cell = None
+        elif tag == 'td':
+            self._cell = None
+
+    def handle_data(self, data):
+        data = data.strip()
+        if not data:
+            return
+        if self._caption is not None:
+            self._caption.append(data)
+        if self._cell is not None:
+            self._cell.append(data)
+
+def parse_html_stream(html):
+    """Parses the schedule tables with a streaming HTMLParser subclass."""
+    parser = ScheduleTableParser()
+    parser.feed(html)
+    parser.close()
+    return parser.schedules
+
+HTML_PARSERS = {
+    'stream': parse_html_stream,
+    'lxml': parse_html_lxml,
+    'bs4': parse_html_bs4,
+}
+
+@timed('parse_html')
+def parse_html(html, engine=None):
+    """Parses the HTML content and extracts schedule data as {date_caption: [entry dict]}."""
+    engine = engine or HTML_PARSER
+    try:
+        schedules = HTML_PARSERS[engine](html)
+    except ImportError as e:
+        logging.error(f"HTML parser '{engine}' is unavailable ({e}), falling back to 'stream'.")
+        schedules = parse_html_stream(html)
+
     logging.info("Parsed HTML content.")
     return schedules
 
 # ---------------------------------------
-# Email Handler
+# Snapshot Archive
 # ---------------------------------------
 
-def read_emails():
-    """Reads emails from the inbox and processes commands."""
-    logging.info("Checking for new emails...")
+# Snapshot file suffix by compression
+SNAPSHOT_SUFFIXES = {'gzip': '.html.gz', 'zstd': '.html.zst'}
+SNAPSHOT_MANIFEST = 'manifest.jsonl'
+
+snapshot_lock = threading.Lock()
+# (directory, source id) -> (hash, compression) of the source's last manifest line
+last_snapshots = {}
+
+def snapshot_path(directory, content_hash, compression):
+    """Returns where a page with the given hash is stored, e.g. objects/3f/3fa9....html.gz."""
+    return os.path.join(directory, 'objects', content_hash[:2], content_hash + SNAPSHOT_SUFFIXES[compression])
+
+@functools.lru_cache(maxsize=None)
+def snapshot_compression():
+    """Returns SNAPSHOT_COMPRESSION, or gzip if it is unknown or zstandard isn't installed."""
+    if SNAPSHOT_COMPRESSION not in SNAPSHOT_SUFFIXES:
+        logging.error(f"Unknown snapshot compression '{SNAPSHOT_COMPRESSION}', falling back to 'gzip'.")
+        return 'gzip'
+    if SNAPSHOT_COMPRESSION == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError as e:
+            logging.error(f"Snapshot compression 'zstd' is unavailable ({e}), falling back to 'gzip'.")
+            return 'gzip'
+    return SNAPSHOT_COMPRESSION
+
+def compress_snapshot(data, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def decompress_snapshot(data, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+@timed('archive_snapshot')
+def archive_snapshot(source, html, directory=None):
+    """Stores a fetched page by content hash and appends the fetch to the manifest.
+
+    A page seen before is not stored again, but it gets another manifest line,
+    so a replay sees the pages in the order they were polled.
+    """
+    directory = directory or SNAPSHOT_DIR
+    compression = snapshot_compression()
+    data = html.encode('utf-8')
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = snapshot_path(directory, content_hash, compression)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name, so an interrupted write never leaves a truncated snapshot
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.partial'
+        with open(partial, 'wb') as f:
+            f.write(compress_snapshot(data, compression))
+        os.replace(partial, path)
+
+    append_manifest(directory, source, 'changed', content_hash, compression)
+    return content_hash
+
+def archive_poll(source, status, directory=None):
+    """Appends an unchanged or not modified fetch to the manifest, pointing at the source's last archived page.
+
+    Returns the hash of that page, or None if no page of the source was archived yet.
+    """
+    directory = directory or SNAPSHOT_DIR
+    with snapshot_lock:
+        last = last_snapshots.get((directory, source.id))
+    if last is None:
+        last = last_manifest_page(directory, source.id)
+    if last is None:
+        logging.info(f"No archived page of {source.id} yet, not archiving its {status} fetch.")
+        return None
+    append_manifest(directory, source, status, *last)
+    return last[0]
+
+def append_manifest(directory, source, status, content_hash, compression):
+    record = {
+        'fetched_at': datetime.now().isoformat(timespec='seconds'),
+        'source': source.id,
+        'url': source.url,
+        'status': status,
+        'hash': content_hash,
+        'compression': compression,
+    }
+    with snapshot_lock:
+        with open(os.path.join(directory, SNAPSHOT_MANIFEST), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        last_snapshots[(directory, source.id)] = (content_hash, compression)
+
+def last_manifest_page(directory, source_id):
+    """Returns (hash, compression) of the last page a source has in the manifest, or None."""
+    last = None
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-        mail.login(BOT_EMAIL, EMAIL_PASSWORD)
-        mail.select('inbox')
+        with open(os.path.join(directory, SNAPSHOT_MANIFEST), encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record['source'] == source_id:
+                        last = (record['hash'], record['compression'])
+    except FileNotFoundError:
+        return None
+    return last
 
-        result, data = mail.search(None, '(UNSEEN)')
-        mail_ids = data[0].split()
-        logging.info(f"Found {len(mail_ids)} new emails.")
+def read_snapshots(directory):
+    """Yields (manifest record, html) of every archived fetch in a snapshot directory, in fetch order.
 
-        if not mail_ids:
-            logging.info("No new emails found.")
-            return
+    Records written before fetches were recorded by status get the status 'changed'.
+    """
+    pages = {}
+    with open(os.path.join(directory, SNAPSHOT_MANIFEST), encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault('status', 'changed')
+            html = pages.get(record['hash'])
+            if html is None:
+                with open(snapshot_path(directory, record['hash'], record['compression']), 'rb') as snapshot:
+                    data = decompress_snapshot(snapshot.read(), record['compression'])
+                html = pages[record['hash']] = data.decode('utf-8')
+            yield record, html
+
+# ---------------------------------------
+# SMTP Connection Pool
+# ---------------------------------------
+
+class PooledSMTPConnection:
+    """An authenticated SMTP connection and its usage bookkeeping."""
+    __slots__ = ('server', 'sent', 'last_used')
+
+    def __init__(self, server):
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+class SMTPConnectionPool:
+    """Keeps a bounded number of authenticated SMTP connections alive for reuse."""
+
+    def __init__(self, host, port, username, password, size=4, max_messages=100, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        """Opens a new connection, upgrades it with STARTTLS and logs in."""
+        import smtplib
+
+        server = smtplib.SMTP(self.host, self.port)
+        try:
+            if SMTP_STARTTLS:
+                server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            self._quit(server)
+            raise
+        return PooledSMTPConnection(server)
+
+    def _quit(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _acquire(self):
+        """Takes an idle connection from the pool, or opens one if none is usable."""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if time.monotonic() - conn.last_used < self.idle_timeout:
+                    return conn
+                self._quit(conn.server)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, discard=False):
+        """Returns a connection to the pool, closing it if it is broken or used up."""
+        try:
+            if discard or conn.sent >= self.max_messages:
+                self._quit(conn.server)
+            else:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def send_message(self, msg):
+        """Sends a message over a pooled connection, reconnecting once if the server hung up."""
+        error = self.send_messages([msg])[0]
+        if error is not None:
+            raise error
+
+    def send_messages(self, msgs):
+        """Sends messages one after another over a pooled connection; returns the error of each, or None.
+
+        The connection is swapped for a new one when it is used up or fails,
+        and a message is retried once if the server hung up.
+        """
+        import smtplib
+
+        errors = []
+        conn = None
+        try:
+            for msg in msgs:
+                for attempt in range(2):
+                    try:
+                        if conn is None:
+                            conn = self._acquire()
+                        conn.server.send_message(msg)
+                    except Exception as e:
+                        if conn is not None:
+                            self._release(conn, discard=True)
+                            conn = None
+                        if not attempt and isinstance(e, smtplib.SMTPServerDisconnected):
+                            logging.info("SMTP connection was closed by the server, reconnecting.")
+                            continue
+                        errors.append(e)
+                    else:
+                        conn.sent += 1
+                        if conn.sent >= self.max_messages:
+                            self._release(conn)
+                            conn = None
+                        errors.append(None)
+                    break
+        finally:
+            if conn is not None:
+                self._release(conn)
+        return errors
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn.server)
+
+smtp_pool = SMTPConnectionPool(
+    SMTP_SERVER,
+    SMTP_PORT,
+    BOT_EMAIL,
+    EMAIL_PASSWORD,
+    size=SMTP_POOL_SIZE,
+    max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION,
+    idle_timeout=SMTP_IDLE_TIMEOUT
+)
+
+# ---------------------------------------
+# Email Handler
+# ---------------------------------------
+
+# Picks the UID out of a FETCH response line
+UID_PATTERN = re.compile(rb'UID (\d+)')
+
+def connect_imap():
+    """Opens an IMAP connection, logs in and selects the inbox."""
+    import imaplib
+
+    imap_class = imaplib.IMAP4_SSL if IMAP_SSL else imaplib.IMAP4
+    mail = imap_class(IMAP_SERVER, IMAP_PORT)
+    mail.login(BOT_EMAIL, EMAIL_PASSWORD)
+    mail.select('inbox')
+    return mail
+
+def fetch_unseen(mail):
+    """Fetches all unseen messages with a single UID FETCH and returns [(uid, email_message)].
+
+    Only the first IMAP_FETCH_LIMIT bytes of each message are pulled, which
+    covers the headers and the text part of a command email but skips
+    attachments. BODY.PEEK leaves the messages unseen until they are processed.
+    """
+    result, data = mail.uid('SEARCH', None, 'UNSEEN')
+    uids = data[0].split()
+    if not uids:
+        return []
+
+    result, data = mail.uid('FETCH', b','.join(uids).decode(), f'(BODY.PEEK[]<0.{IMAP_FETCH_LIMIT}>)')
+    messages = []
+    pending = None
+    for item in data:
+        if isinstance(item, tuple):
+            match = UID_PATTERN.search(item[0])
+            pending = email.message_from_bytes(item[1])
+        elif pending is not None and item:
+            # Some servers send the UID after the message literal
+            match = UID_PATTERN.search(item)
+        else:
+            continue
+        if match:
+            messages.append((match.group(1), pending))
+            pending = None
+    return messages
+
+@timed('process_unseen')
+def process_unseen(mail):
+    """Processes all unseen messages as one batch, marks them seen with one UID STORE and sends the replies.
 
-        for mail_id in mail_ids:
-            result, message_data = mail.fetch(mail_id, '(RFC822)')
-            raw_email = message_data[0][1]
-            email_message = email.message_from_bytes(raw_email)
+    If storing the batch fails, the messages stay unseen and are processed
+    again on the next pass.
+    """
+    messages = fetch_unseen(mail)
+    logging.info(f"Found {len(messages)} new emails.")
+    if not messages:
+        return
 
-            process_email(email_message)
+    commands = []
+    for uid, email_message in messages:
+        try:
+            commands.append(parse_command(email_message))
+        except Exception as e:
+            logging.error(f"Error parsing email {uid.decode()}: {e}")
+    replies = process_commands(commands)
 
-            # Mark email as seen
-            mail.store(mail_id, '+FLAGS', '\\Seen')
+    mail.uid('STORE', b','.join(uid for uid, _ in messages).decode(), '+FLAGS', '(\\Seen)')
+    send_emails(replies)
 
-        mail.logout()
+@timed('read_emails')
+def read_emails():
+    """Reads emails from the inbox and processes commands."""
+    logging.info("Checking for new emails...")
+    try:
+        mail = connect_imap()
+        try:
+            process_unseen(mail)
+        finally:
+            mail.logout()
     except Exception as e:
         logging.error(f"Error reading emails: {e}")
 
-def process_email(email_message):
-    """Processes an individual email message."""
-    from_email = email.utils.parseaddr(email_message['From'])[1]
-    subject = email_message['Subject']
-    body = get_email_body(email_message)
+def imap_idle(mail, timeout):
+    """Waits in IDLE until the server reports new mail or timeout passes; returns True on new mail.
 
-    logging.info(f"Processing email from {from_email} with subject '{subject}'.")
+    imaplib has no IDLE command before Python 3.14, so this drives it with
+    the connection's own tag counter and line reader; tests/test_imap_idle.py
+    covers it against the IMAP stand-in.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    line = mail.readline()
+    if not line.startswith(b'+'):
+        raise mail.error(f"IDLE rejected: {line!r}")
+
+    new_mail = False
+    mail.sock.settimeout(timeout)
+    try:
+        while True:
+            line = mail.readline()
+            if not line:
+                raise mail.abort("connection closed during IDLE")
+            if is_new_mail_response(line):
+                new_mail = True
+                break
+    except socket.timeout:
+        # A timed-out socket file refuses further reads, so start a fresh one
+        mail.file = mail.sock.makefile('rb')
+    finally:
+        mail.sock.settimeout(None)
 
-    if "START" in subject.upper():
-        handle_start_command(from_email, body)
-    elif "STOP" in subject.upper():
-        handle_stop_command(from_email)
-    elif "HELP" in subject.upper():
-        send_usage_instructions(from_email)
-    else:
-        logging.info(f"Unknown command from {from_email}.")
+    mail.send(b'DONE\r\n')
+    while True:
+        line = mail.readline()
+        if not line:
+            raise mail.abort("connection closed while ending IDLE")
+        if line.startswith(tag):
+            return new_mail
+        # Mail may also arrive between the timeout and DONE
+        new_mail = new_mail or is_new_mail_response(line)
+
+def is_new_mail_response(line):
+    return line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line)
+
+def watch_inbox(stop):
+    """Keeps an IMAP session open and processes new mail as soon as IDLE reports it.
+
+    Falls back to polling every EMAIL_CHECK_INTERVAL if the server lacks IDLE,
+    and reconnects with backoff on errors until stop is set. Only the inbox
+    leader keeps a session open.
+    """
+    backoff = 1
+    while not stop.is_set():
+        if not inbox_leader.is_leader():
+            stop.wait(EMAIL_CHECK_INTERVAL * 60)
+            continue
+        mail = None
+        try:
+            mail = connect_imap()
+            logging.info("IMAP session started.")
+            backoff = 1
+            process_unseen(mail)
+            while not stop.is_set() and inbox_leader.is_leader():
+                if 'IDLE' not in mail.capabilities:
+                    stop.wait(EMAIL_CHECK_INTERVAL * 60)
+                    process_unseen(mail)
+                elif imap_idle(mail, IMAP_IDLE_TIMEOUT):
+                    process_unseen(mail)
+        except Exception as e:
+            logging.error(f"IMAP session failed: {e}, reconnecting in {backoff}s.")
+            stop.wait(backoff)
+            backoff = min(backoff * 2, 300)
+        finally:
+            if mail is not None:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+
+def start_inbox_watcher():
+    """Runs watch_inbox on a daemon thread and returns the event that stops it."""
+    stop = threading.Event()
+    threading.Thread(target=watch_inbox, args=(stop,), name='inbox-watcher', daemon=True).start()
+    return stop
+
+# Subject keywords of the inbox commands, in order of precedence
+INBOX_COMMANDS = ('START', 'STOP', 'HELP')
+
+def parse_command(email_message):
+    """Returns the (command, sender, body) of an email; command is None if the subject names none."""
+    from_email = email.utils.parseaddr(email_message['From'])[1]
+    subject = (email_message['Subject'] or '').upper()
+    command = next((command for command in INBOX_COMMANDS if command in subject), None)
+    return command, from_email, get_email_body(email_message) or ''
+
+@timed('process_commands')
+def process_commands(commands):
+    """Applies a batch of (command, sender, body) inbox commands and returns the replies to send.
+
+    Of several START and STOP commands from one sender only the last one
+    counts. All registrations and removals are stored in one transaction,
+    which raises if it fails, so the caller can retry the batch. Replies are
+    (to_email, subject, html_content) tuples for send_emails.
+    """
+    enabled = enabled_sources() if any(command == 'START' for command, _, _ in commands) else set()
+    changes = {}  # address -> (name, class_name, language, source_id, rules), or None to remove
+    replies = []
+    for command, from_email, body in commands:
+        logging.info(f"Processing {command or 'unknown'} command from {from_email}.")
+        if command == 'START':
+            address = validate_email_address(from_email)
+            if not address:
+                continue
+            name, class_name, language, source_id = parse_client_info(body)
+            source_id = source_id or DEFAULT_SOURCE
+            if name and class_name and language and source_id in enabled:
+                changes[address] = (name, class_name, language, source_id, parse_subscription_rules(body))
+            else:
+                replies.append((from_email, *usage_instructions_email()))
+        elif command == 'STOP':
+            changes[validate_email_address(from_email) or from_email] = None
+        elif command == 'HELP':
+            replies.append((from_email, *usage_instructions_email()))
+        else:
+            logging.info(f"Unknown command from {from_email}.")
+
+    if changes:
+        store_client_changes(changes)
+    for address, registration in changes.items():
+        if registration is None:
+            replies.append((address, *stop_email()))
+        else:
+            name, class_name, language, _, rules = registration
+            replies.append((address, *confirmation_email(name, class_name, language, rules)))
+    return replies
 
 def get_email_body(email_message):
     """Extracts the body from an email message."""
@@ -230,113 +1907,171 @@ def get_email_body(email_message):
     else:
         return email_message.get_payload(decode=True).decode('utf-8', errors='ignore')
 
-def handle_start_command(from_email, body):
-    """Handles the START command to register a new client."""
-    name, class_name, language = parse_client_info(body)
-    if name and class_name and language:
-        store_client_info(from_email, name, class_name, language)
-        send_confirmation_email(from_email, name, class_name, language)
-    else:
-        send_usage_instructions(from_email)
-
-def handle_stop_command(from_email):
-    """Handles the STOP command to remove a client."""
-    remove_client_data(from_email)
-    send_stop_email(from_email)
-
 def parse_client_info(body):
     """Parses client information from the email body."""
     lines = body.strip().split('\n')
-    name = class_name = language = None
+    name = class_name = language = source_id = None
 
     for line in lines:
         if line.startswith("Name:"):
             name = line.split("Name:")[1].strip()
         elif line.startswith("Class:"):
-            class_name = line.split("Class:")[1].strip().upper()
+            # Further classes of the line become subscription rules
+            class_name = line.split("Class:")[1].split(',')[0].strip().upper()
         elif line.startswith("Language:"):
             language = line.split("Language:")[1].strip().lower()
-
-    return name, class_name, language
-
-def store_client_info(email_address, name, class_name, language):
-    """Stores or updates client information in the database."""
-    session = SessionLocal()
-    email_address = validate_email_address(email_address)
-    if not email_address:
-        logging.error(f"Invalid email address: {email_address}")
-        return
-
-    try:
-        # Check if client already exists
-        client = session.query(Client).filter(Client.email == email_address).first()
-        if client:
-            # Update existing client information
-            client.name = name
-            client.class_name = class_name
-            client.language = language
-            session.commit()
-            logging.info(f"Updated client info for: {email_address}")
-        else:
-            # Create new client
-            client = Client(
-                email=email_address,
-                name=name,
-                class_name=class_name,
-                language=language
+        elif line.startswith("School:"):
+            source_id = line.split("School:")[1].strip().lower()
+
+    return name, class_name, language, source_id
+
+# Body lines that add subscription rules, e.g. 'Teacher: Nagy Anna, Kiss Péter' or 'Exclude Subject: testnevelés'
+RULE_LINES = {
+    'class:': ('include', 'class'),
+    'teacher:': ('include', 'teacher'),
+    'subject:': ('include', 'subject'),
+    'exclude class:': ('exclude', 'class'),
+    'exclude teacher:': ('exclude', 'teacher'),
+    'exclude subject:': ('exclude', 'subject'),
+}
+
+def parse_subscription_rules(body):
+    """Parses the (kind, field, value) subscription rules of a START email body.
+
+    The first class of the 'Class:' line is the client's own class and not a
+    rule; the others are.
+    """
+    rules = []
+    for line in body.strip().split('\n'):
+        prefix, colon, values = line.partition(':')
+        kind, field = RULE_LINES.get(' '.join(prefix.lower().split()) + colon, (None, None))
+        if kind is None:
+            continue
+        values = [rule_value(field, value) for value in values.split(',') if value.strip()]
+        if (kind, field) == ('include', 'class'):
+            values = values[1:]
+        for value in values:
+            if (kind, field, value) not in rules:
+                rules.append((kind, field, value))
+    return rules
+
+def enabled_sources():
+    """Returns the ids of the sources being scraped."""
+    with SessionLocal() as session:
+        return set(session.scalars(select(Source.id).where(Source.enabled.is_(True))))
+
+def store_client_changes(changes):
+    """Stores registrations and removals in one transaction, with one bulk statement per table.
+
+    changes maps client addresses to (name, class_name, language, source_id,
+    rules), or to None to remove the client. Registered clients are upserted
+    and their subscription rules replaced.
+    """
+    registrations = {address: registration for address, registration in changes.items() if registration}
+    removals = [address for address, registration in changes.items() if registration is None]
+    removed = set()
+    with session_scope() as session:
+        if registrations:
+            insert = upsert_insert(session.get_bind().dialect.name)
+            stmt = insert(Client)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['email'],
+                set_={column: stmt.excluded[column] for column in ('name', 'class_name', 'language', 'source_id')}
             )
-            session.add(client)
-            session.commit()
-            logging.info(f"Registered new client: {email_address}")
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Error storing client info: {e}")
-    finally:
-        session.close()
-
-def remove_client_data(email_address):
-    """Removes client data from the database."""
-    session = SessionLocal()
-    try:
-        client = session.query(Client).filter(Client.email == email_address).first()
-        if client:
-            session.delete(client)
-            session.commit()
-            logging.info(f"Removed client data for: {email_address}")
-        else:
-            logging.info(f"No client data found for: {email_address}")
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Error removing client data: {e}")
-    finally:
-        session.close()
+            session.execute(stmt, [
+                {'email': address, 'name': name, 'class_name': class_name, 'language': language, 'source_id': source_id}
+                for address, (name, class_name, language, source_id, _) in registrations.items()
+            ])
+        session.execute(
+            delete(SubscriptionRule).where(SubscriptionRule.client_email.in_(list(changes))),
+            execution_options={'synchronize_session': False}
+        )
+        rules = [
+            {'client_email': address, 'kind': kind, 'field': field, 'value': value}
+            for address, registration in registrations.items() for kind, field, value in registration[4]
+        ]
+        if rules:
+            session.execute(SubscriptionRule.__table__.insert(), rules)
+        if removals:
+            removed.update(session.scalars(
+                delete(Client).where(Client.email.in_(removals)).returning(Client.email),
+                execution_options={'synchronize_session': False}
+            ))
+            # Drop pending notifications too, other replicas may not have noticed the removal yet
+            session.execute(
+                delete(OutboxMessage).where(OutboxMessage.client_email.in_(removals), OutboxMessage.sent_at.is_(None)),
+                execution_options={'synchronize_session': False}
+            )
+        version = count_change(session, SUBSCRIBER_CHANGES)
+
+    for address, (name, class_name, language, source_id, rules) in registrations.items():
+        subscriber_index.upsert(address, name, class_name, language, source_id, rules)
+    for address in removed:
+        subscriber_index.remove(address)
+    subscriber_index.applied(version)
+    logging.info(
+        f"Stored {len(registrations)} registrations and {len(removed)} removals"
+        f" ({len(removals) - len(removed)} unsubscribing senders weren't registered)."
+    )
 
-def send_email(to_email, subject, html_content):
-    """Sends an email with HTML content."""
-    msg = MIMEMultipart()
+def build_email(to_email, subject, html_content, text_content=None):
+    """Builds an HTML email from the bot address, as multipart/alternative if a text version is given."""
+    if text_content is None:
+        msg = MIMEMultipart()
+    else:
+        msg = MIMEMultipart('alternative')
+        msg.attach(MIMEText(text_content, 'plain'))
     msg.attach(MIMEText(html_content, 'html'))
     msg['Subject'] = subject
     msg['From'] = BOT_EMAIL
     msg['To'] = to_email
+    return msg
+
+@timed('send_email')
+def send_email(to_email, subject, html_content, raise_errors=False, text_content=None):
+    """Sends an email with HTML content, re-raising failures if raise_errors is set."""
+    msg = build_email(to_email, subject, html_content, text_content)
 
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(BOT_EMAIL, EMAIL_PASSWORD)
-            server.send_message(msg)
-        logging.info(f"Sent email to {to_email} with subject '{subject}'.")
+        smtp_pool.send_message(msg)
+        emails_total.inc(result='sent')
+        logging.debug(f"Sent email to {to_email} with subject '{subject}'.")
     except Exception as e:
+        emails_total.inc(result='failed')
         logging.error(f"Error sending email to {to_email}: {e}")
+        if raise_errors:
+            raise
+
+@timed('send_emails')
+def send_emails(emails):
+    """Sends (to_email, subject, html_content) emails as one batch over a pooled SMTP connection."""
+    if not emails:
+        return
+    errors = smtp_pool.send_messages([build_email(*email_args) for email_args in emails])
+    for (to_email, subject, _), error in zip(emails, errors):
+        if error is None:
+            emails_total.inc(result='sent')
+            logging.debug(f"Sent email to {to_email} with subject '{subject}'.")
+        else:
+            emails_total.inc(result='failed')
+            logging.error(f"Error sending email to {to_email}: {error}")
 
-def send_usage_instructions(to_email):
-    """Sends usage instructions to the client."""
+def usage_instructions_email():
+    """Returns the subject and HTML content of the usage instructions."""
     html_content = """
     <html>
     <body>
         <p>To register for notifications, please send an email with the subject 'START' and the following information in the body:</p>
         <p>Name: [Your Name]<br>
         Class: [Your Class]<br>
-        Language: [Your Second Language]</p>
+        Language: [Your Second Language]<br>
+        School: [School ID, only needed if the bot watches several schools]</p>
+        <p>Optionally, narrow or widen what you receive with any of these lines, listing several values separated by commas:</p>
+        <p>Class: [Your Class], [Further Classes]<br>
+        Teacher: [Teachers whose lessons you want to follow]<br>
+        Subject: [Subjects you want to follow in any class]<br>
+        Exclude Class: / Exclude Teacher: / Exclude Subject: [Changes you don't want to receive]</p>
+        <p>Lessons of another second language than yours are left out.</p>
         <p>Example:</p>
         <p>Name: John Doe<br>
         Class: 10.BE<br>
@@ -345,25 +2080,28 @@ def send_usage_instructions(to_email):
     </body>
     </html>
     """
-    send_email(to_email, "Usage Instructions", html_content)
+    return "Usage Instructions", html_content
 
-def send_confirmation_email(to_email, name, class_name, language):
-    """Sends a confirmation email to the client."""
+def confirmation_email(name, class_name, language, rules=()):
+    """Returns the subject and HTML content of a registration confirmation, listing the subscription rules."""
+    rule_lines = ''.join(
+        f"<br>\n        {kind.capitalize()} {field}: {html_lib.escape(value)}" for kind, field, value in rules
+    )
     html_content = f"""
     <html>
     <body>
         <p>Dear {name},</p>
         <p>You have been successfully registered for notifications.</p>
         <p>Class: {class_name}<br>
-        Language: {language}</p>
+        Language: {language}{rule_lines}</p>
         <p>Thank you!</p>
     </body>
     </html>
     """
-    send_email(to_email, "Registration Confirmation", html_content)
+    return "Registration Confirmation", html_content
 
-def send_stop_email(to_email):
-    """Sends a farewell email to the client."""
+def stop_email():
+    """Returns the subject and HTML content of the farewell email."""
     html_content = """
     <html>
     <body>
@@ -372,22 +2110,270 @@ def send_stop_email(to_email):
     </body>
     </html>
     """
-    send_email(to_email, "Unsubscription Confirmation", html_content)
+    return "Unsubscription Confirmation", html_content
+
+# ---------------------------------------
+# Notification Dispatcher
+# ---------------------------------------
+
+class TokenBucket:
+    """Blocking token bucket that limits how often a provider may be called."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token, borrowing against the future if needed, and returns the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        """Waits until a token is available and takes it."""
+        time.sleep(self.reserve())
+
+class NotificationJob:
+    """A single queued delivery and its retry state."""
+    __slots__ = ('provider', 'func', 'args', 'enqueued_at', 'attempt')
+
+    def __init__(self, provider, func, args):
+        self.provider = provider
+        self.func = func
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        self.attempt = 0
+
+class NotificationDispatcher:
+    """Delivers queued notifications on a pool of worker threads."""
+
+    def __init__(self, workers=4, rate_limits=None, max_retries=3, retry_backoff=2):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._buckets = {
+            provider: TokenBucket(rate, burst)
+            for provider, (rate, burst) in (rate_limits or {}).items()
+        }
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._retrying = 0
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        """Starts the worker threads if they are not running yet."""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"notifier-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logging.info(f"Notification dispatcher started with {self.workers} workers.")
+
+    def stop(self, timeout=None):
+        """Lets the workers drain the queue and waits for them to exit."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, provider, func, *args):
+        """Queues func(*args) for delivery through the given provider."""
+        self.start()
+        self._queue.put(NotificationJob(provider, func, args))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            bucket = self._buckets.get(job.provider)
+            if bucket:
+                bucket.acquire()
+            try:
+                job.func(*job.args)
+            except Exception as e:
+                self._retry(job, e)
+            else:
+                self._record_success(job)
+
+    def _record_success(self, job):
+        latency = time.monotonic() - job.enqueued_at
+        with self._lock:
+            self._sent += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+
+    def _retry(self, job, error):
+        """Re-queues a failed job after an exponential backoff, or gives up."""
+        if job.attempt >= self.max_retries:
+            with self._lock:
+                self._failed += 1
+            logging.error(f"Giving up on {job.provider} notification after {job.attempt + 1} attempts: {error}")
+            return
+
+        delay = self.retry_backoff * 2 ** job.attempt
+        job.attempt += 1
+        with self._lock:
+            self._retried += 1
+            self._retrying += 1
+        logging.info(f"Retrying {job.provider} notification in {delay:.1f}s (attempt {job.attempt + 1}).")
+        self._requeue_later(job, delay)
+
+    def _requeue_later(self, job, delay):
+        timer = threading.Timer(delay, self._requeue, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, job):
+        with self._lock:
+            self._retrying -= 1
+        self._queue.put(job)
+
+    def stats(self):
+        """Returns queue depth, delivery counters and latency figures."""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'retrying': self._retrying,
+                'sent': self._sent,
+                'failed': self._failed,
+                'retried': self._retried,
+                'latency_avg': self._latency_total / self._sent if self._sent else 0.0,
+                'latency_max': self._latency_max,
+            }
+
+dispatcher = NotificationDispatcher(
+    workers=NOTIFY_WORKERS,
+    rate_limits={'email': (SMTP_RATE_LIMIT, SMTP_RATE_BURST)},
+    max_retries=NOTIFY_MAX_RETRIES,
+    retry_backoff=NOTIFY_RETRY_BACKOFF
+)
 
 # ---------------------------------------
 # Notifier
 # ---------------------------------------
 
-def compose_message(entries, is_new=True):
-    """Composes a notification message from schedule entries, returns HTML content."""
-    messages = []
-    status = "🆕 Lesson Change" if is_new else "✏️ Updated Entry"
+# Headings of the notification statuses
+STATUS_TITLES = {
+    'new': "🆕 Lesson Change",
+    'updated': "✏️ Updated Entry",
+    'cancelled': "🚫 Cancelled",
+}
 
+# Templates compiled once at import; values are substituted per entry
+ENTRY_HTML_TEMPLATE = Template("""
+        <div style="border:1px solid #ccc; padding:15px; margin-bottom:15px; border-radius:10px;">
+            <h2 style="color:#2E86C1;">$title</h2>
+            <p style="font-size:18px;"><strong>📅 Date:</strong> $date_str</p>
+            <p style="font-size:18px;"><strong>🏫 Class:</strong> $class_name</p>
+            <p style="font-size:18px;"><strong>📖 Lesson:</strong> $lesson</p>
+            <p style="font-size:18px;"><strong>🧪 Subject:</strong> $subject</p>
+            <p style="font-size:18px;"><strong>👩‍🏫 Stand-in Teacher:</strong> $stand_in_teacher</p>
+            <p style="font-size:18px;"><strong>❌👨‍🏫 Missing Teacher:</strong> $missing_teacher</p>
+            <p style="font-size:18px;"><strong>🚪 Room:</strong> $room</p>
+            <p style="font-size:18px;"><strong>💬 Comment:</strong> $comment</p>
+        </div>
+        """)
+
+ENTRY_TEXT_TEMPLATE = Template("""$title
+📅 Date: $date_str
+🏫 Class: $class_name
+📖 Lesson: $lesson
+🧪 Subject: $subject
+👩‍🏫 Stand-in Teacher: $stand_in_teacher
+❌👨‍🏫 Missing Teacher: $missing_teacher
+🚪 Room: $room
+💬 Comment: $comment
+""")
+
+MESSAGE_HTML_TEMPLATE = Template("""
+    <html>
+    <body>
+        <div style="font-family:Arial, sans-serif; font-size:16px; color:#333;">
+            $entries
+        </div>
+    </body>
+    </html>
+    """)
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used key beyond maxsize."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class RenderedMessage:
+    """HTML and plain-text versions of a notification."""
+    __slots__ = ('html', 'text')
+
+    def __init__(self, html, text):
+        self.html = html
+        self.text = text
+
+# Rendered entries keyed by (fingerprint, date, day label, status), and whole batches keyed by
+# (class, status, day labels and sorted fingerprints)
+entry_fragment_cache = LRUCache(MESSAGE_CACHE_SIZE * 16)
+message_cache = LRUCache(MESSAGE_CACHE_SIZE)
+
+def render_entry(entry, date_str, status):
+    """Renders the HTML and text fragments of an entry, reusing cached ones."""
+    key = (getattr(entry, 'fingerprint', None) or schedule_fingerprint(entry), entry.date, date_str, status)
+    fragment = entry_fragment_cache.get(key)
+    if fragment is None:
+        values = {column: getattr(entry, column) or '' for column in SCHEDULE_COLUMNS}
+        values['title'] = STATUS_TITLES[status]
+        values['date_str'] = date_str
+        fragment = (
+            ENTRY_HTML_TEMPLATE.substitute({name: html_lib.escape(value) for name, value in values.items()}),
+            ENTRY_TEXT_TEMPLATE.substitute(values)
+        )
+        entry_fragment_cache.put(key, fragment)
+    return key, fragment
+
+@timed('compose_digest')
+def compose_digest(items):
+    """Composes one message from (entry, status) pairs of possibly different statuses."""
     # Get today's date and tomorrow's date
     today = datetime.now().date()
     tomorrow = today + timedelta(days=1)
 
-    for entry in entries:
+    keys = []
+    fragments = []
+    for entry, status in items:
         entry_date = entry.date
         # Check if the date is today or tomorrow
         date_str = entry_date.strftime('%Y-%m-%d')
@@ -396,198 +2382,1120 @@ def compose_message(entries, is_new=True):
         elif entry_date == tomorrow:
             date_str += " (Tomorrow)"
 
-        # Build the HTML content for the entry
-        msg = f"""
-        <div style="border:1px solid #ccc; padding:15px; margin-bottom:15px; border-radius:10px;">
-            <h2 style="color:#2E86C1;">{status}</h2>
-            <p style="font-size:18px;"><strong>📅 Date:</strong> {date_str}</p>
-            <p style="font-size:18px;"><strong>🏫 Class:</strong> {entry.class_name}</p>
-            <p style="font-size:18px;"><strong>📖 Lesson:</strong> {entry.lesson}</p>
-            <p style="font-size:18px;"><strong>🧪 Subject:</strong> {entry.subject}</p>
-            <p style="font-size:18px;"><strong>👩‍🏫 Stand-in Teacher:</strong> {entry.stand_in_teacher}</p>
-            <p style="font-size:18px;"><strong>❌👨‍🏫 Missing Teacher:</strong> {entry.missing_teacher}</p>
-            <p style="font-size:18px;"><strong>🚪 Room:</strong> {entry.room}</p>
-            <p style="font-size:18px;"><strong>💬 Comment:</strong> {entry.comment}</p>
-        </div>
-        """
-        messages.append(msg)
+        key, fragment = render_entry(entry, date_str, status)
+        keys.append(key)
+        fragments.append(fragment)
+
+    class_names = tuple(sorted({entry.class_name for entry, _ in items}))
+    batch_key = (class_names, tuple(sorted(keys)))
+    message = message_cache.get(batch_key)
+    if message is None:
+        message = RenderedMessage(
+            MESSAGE_HTML_TEMPLATE.substitute(entries=''.join(html for html, _ in fragments)),
+            '\n'.join(text for _, text in fragments)
+        )
+        message_cache.put(batch_key, message)
+    return message
+
+def notify_clients(entries, status='new', session=None):
+    """Queues notifications about new, updated or cancelled schedule entries in the outbox.
+
+    With a session the outbox rows join the caller's transaction, so they are
+    committed together with the entries; otherwise they are committed here.
+    """
+    now = datetime.now()
+    next_attempt_at = now + timedelta(seconds=NOTIFY_DIGEST_WINDOW)
+    rows = []
+    for entry, emails in zip(entries, subscriber_index.resolve(entries)):
+        if not emails:
+            logging.debug(f"No clients found for entry {entry.id} of class {entry.class_name}.")
+            continue
+        for client_email in emails:
+            rows.append({
+                'client_email': client_email,
+                'entry_id': entry.id,
+                'fingerprint': entry.fingerprint,
+                'status': status,
+                'created_at': now,
+                'next_attempt_at': next_attempt_at,
+                'attempts': 0,
+            })
+
+    if not rows:
+        return
+    if session is None:
+        with session_scope() as own_session:
+            enqueue_outbox(own_session, rows)
+    else:
+        enqueue_outbox(session, rows)
+    logging.info(f"Queued {len(rows)} {status} notifications in the outbox.")
 
-    # Combine the messages
-    html_content = f"""
-    <html>
-    <body>
-        <div style="font-family:Arial, sans-serif; font-size:16px; color:#333;">
-            {''.join(messages)}
-        </div>
-    </body>
-    </html>
+# ---------------------------------------
+# Notification Outbox
+# ---------------------------------------
+
+# How a pending status combines with a later one for the same entry; None drops the entry
+DIGEST_TRANSITIONS = {
+    ('new', 'new'): 'new',
+    ('new', 'updated'): 'new',
+    ('new', 'cancelled'): None,
+    ('updated', 'new'): 'updated',
+    ('updated', 'updated'): 'updated',
+    ('updated', 'cancelled'): 'cancelled',
+    ('cancelled', 'new'): 'updated',
+    ('cancelled', 'updated'): 'updated',
+    ('cancelled', 'cancelled'): 'cancelled',
+}
+
+# Delivery counters of this process
+outbox_stats = {'claimed': 0, 'sent': 0, 'failed': 0, 'skipped': 0, 'expired': 0}
+
+def enqueue_outbox(session, rows):
+    """Inserts outbox rows, merging ones still unsent for the same client, entry version and status.
+
+    A merged row takes the newer created_at, so deliver_outbox coalesces it
+    after the statuses queued in between, e.g. a cancellation that the entry
+    coming back undoes.
+    """
+    insert = upsert_insert(session.get_bind().dialect.name)
+    stmt = insert(OutboxMessage)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['client_email', 'entry_id', 'fingerprint', 'status'],
+        index_where=OutboxMessage.sent_at.is_(None),
+        set_={'created_at': stmt.excluded.created_at}
+    )
+    # Executemany keeps a fan-out to thousands of subscribers under the driver's bound parameter limit
+    session.execute(stmt, rows)
+
+def claimable_outbox(now):
+    """Conditions of outbox rows that still need delivery and are not claimed by anyone."""
+    return (
+        OutboxMessage.sent_at.is_(None),
+        OutboxMessage.attempts < OUTBOX_MAX_ATTEMPTS,
+        or_(OutboxMessage.locked_until.is_(None), OutboxMessage.locked_until < now),
+    )
+
+def claim_outbox(limit):
+    """Claims up to limit due outbox rows plus the other pending rows of the same clients.
+
+    Rows are locked with FOR UPDATE SKIP LOCKED on PostgreSQL so parallel
+    workers never claim the same row, and leased for OUTBOX_LEASE seconds so
+    a crashed worker's claims are picked up again. Returns the claimed rows
+    in the order they were queued, the schedule entries they refer to, by id,
+    and the lease they are locked until.
+    """
+    now = datetime.now()
+    lease = now + timedelta(seconds=OUTBOX_LEASE)
+    with SessionLocal() as session:
+        due_clients = set(session.scalars(
+            select(OutboxMessage.client_email)
+            .where(OutboxMessage.next_attempt_at <= now, *claimable_outbox(now))
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ))
+        if not due_clients:
+            return [], {}, lease
+
+        # Pull in the clients' rows that are not due yet, so each client gets a single message
+        messages = session.execute(
+            select(OutboxMessage.id, OutboxMessage.client_email, OutboxMessage.entry_id, OutboxMessage.status)
+            .where(OutboxMessage.client_email.in_(due_clients), *claimable_outbox(now))
+            .order_by(OutboxMessage.created_at, OutboxMessage.id)
+            .with_for_update(skip_locked=True)
+        ).all()
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_([message.id for message in messages]))
+            .values(locked_until=lease)
+        )
+        entries = session.execute(
+            select(*ScheduleEntry.__table__.columns)
+            .where(ScheduleEntry.id.in_({message.entry_id for message in messages}))
+        ).all()
+        session.commit()
+
+    outbox_stats['claimed'] += len(messages)
+    return messages, {entry.id: entry for entry in entries}, lease
+
+def deliver_outbox():
+    """Claims due outbox rows and queues one coalesced message per client on the dispatcher.
+
+    Nothing is claimed while earlier messages still wait in the dispatcher,
+    and a claim holds at most the messages the rate limit lets through within
+    OUTBOX_LEASE, so leases don't run out while their messages are queued.
     """
-    return html_content
+    stats = dispatcher.stats()
+    if stats['queue_depth'] or stats['retrying']:
+        return
+    try:
+        messages, entries, lease = claim_outbox(min(OUTBOX_BATCH_SIZE, max(1, int(SMTP_RATE_LIMIT * OUTBOX_LEASE))))
+    except Exception as e:
+        logging.error(f"Error claiming outbox rows: {e}")
+        return
 
-def send_notifications(clients, message):
-    """Sends notifications to clients via their preferred channels."""
-    for client in clients:
+    by_client = {}
+    for message in messages:
+        by_client.setdefault(message.client_email, []).append(message)
+
+    subscribed = subscriber_index.lookup_emails(by_client)
+    skipped = []
+    for client_email, client_messages in by_client.items():
+        items = {}
+        for message in client_messages:
+            entry = entries.get(message.entry_id)
+            if entry is None:
+                continue
+            previous = items.get(entry.id)
+            merged = DIGEST_TRANSITIONS[previous[1], message.status] if previous else message.status
+            if merged is None:
+                del items[entry.id]
+            else:
+                items[entry.id] = (entry, merged)
+
+        outbox_ids = [message.id for message in client_messages]
+        if not items or client_email not in subscribed:
+            skipped.extend(outbox_ids)
+            continue
+        dispatcher.submit(
+            'email', send_outbox_message, client_email, outbox_ids, lease, compose_digest(list(items.values()))
+        )
+
+    if skipped:
+        # Changes that cancelled each other out, or clients that have unsubscribed since
+        mark_outbox_sent(skipped, lease)
+        outbox_stats['skipped'] += len(skipped)
+    if messages:
+        logging.info(f"Claimed {len(messages)} outbox rows for {len(by_client)} clients.")
+
+def send_outbox_message(client_email, outbox_ids, lease, message):
+    """Sends a coalesced notification and records the outcome on its outbox rows, if their claim still holds."""
+    lease = renew_outbox_claim(outbox_ids, lease)
+    if lease is None:
+        outbox_stats['expired'] += 1
+        return
+    try:
         # Send email notification
-        send_email(client.email, "Schedule Update", message)
+        send_email(client_email, "Schedule Update", message.html, True, message.text)
 
         # Implement Telegram notification if needed
         # send_telegram_message(client.telegram_chat_id, message)
 
         # Implement Discord notification if needed
         # send_discord_message(client.discord_webhook_url, message)
+    except Exception as e:
+        record_outbox_failure(outbox_ids, lease, e)
+        outbox_stats['failed'] += 1
+    else:
+        mark_outbox_sent(outbox_ids, lease)
+        outbox_stats['sent'] += 1
+
+def held_outbox(outbox_ids, lease):
+    """Conditions of the given outbox rows that are unsent and still locked by the claim with this lease."""
+    return (
+        OutboxMessage.id.in_(outbox_ids),
+        OutboxMessage.sent_at.is_(None),
+        OutboxMessage.locked_until == lease,
+    )
 
-    logging.info(f"Sent notifications to {len(clients)} clients.")
+def renew_outbox_claim(outbox_ids, lease):
+    """Extends the claim on outbox rows right before sending; returns the new lease, or None if the claim was lost.
 
-def notify_clients(entries, is_new=True):
-    """Notifies clients about new or updated schedule entries."""
-    session = SessionLocal()
-    class_entries = {}
-    for entry in entries:
-        class_entries.setdefault(entry.class_name, []).append(entry)
-
-    for class_name, entries in class_entries.items():
-        clients = session.query(Client).filter(Client.class_name == class_name).all()
-        if clients:
-            message = compose_message(entries, is_new)
-            send_notifications(clients, message)
-        else:
-            logging.info(f"No clients found for class {class_name}.")
+    The claim is lost once a row was reclaimed by another worker after the
+    lease ran out. Its messages are then left to that worker.
+    """
+    renewed = datetime.now() + timedelta(seconds=OUTBOX_LEASE)
+    with SessionLocal() as session:
+        result = session.execute(update(OutboxMessage).where(*held_outbox(outbox_ids, lease)).values(locked_until=renewed))
+        if result.rowcount != len(outbox_ids):
+            session.rollback()
+            logging.info(f"Claim on outbox rows {outbox_ids} was lost before sending, leaving them to the new claim.")
+            return None
+        session.commit()
+    return renewed
+
+def mark_outbox_sent(outbox_ids, lease):
+    """Marks outbox rows as delivered, if the claim with this lease still holds them."""
+    with SessionLocal() as session:
+        session.execute(
+            update(OutboxMessage)
+            .where(*held_outbox(outbox_ids, lease))
+            .values(sent_at=datetime.now(), locked_until=None)
+        )
+        session.commit()
+
+def record_outbox_failure(outbox_ids, lease, error):
+    """Counts a failed attempt on held outbox rows and schedules their retry with exponential backoff."""
+    now = datetime.now()
+    with SessionLocal() as session:
+        for message in session.scalars(select(OutboxMessage).where(*held_outbox(outbox_ids, lease))):
+            message.next_attempt_at = now + timedelta(seconds=OUTBOX_RETRY_BACKOFF * 2 ** message.attempts)
+            message.attempts += 1
+            message.locked_until = None
+            message.last_error = str(error)[:500]
+            if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                logging.error(f"Giving up on outbox row {message.id} for {message.client_email}: {error}")
+        session.commit()
+
+# ---------------------------------------
+# Leader Election
+# ---------------------------------------
+
+class LeaderElection:
+    """Elects one leader among the replicas sharing the database.
 
-    session.close()
+    On PostgreSQL the leader holds a session-level advisory lock on a
+    dedicated connection, which the server releases as soon as that
+    connection dies. Other databases fall back to an exclusive lock on
+    a file next to LEADER_LOCK_FILE, which only coordinates processes on one
+    host.
+    Followers try to take over on every check, so a new leader runs within
+    one check interval of the old one going away.
+    """
 
+    def __init__(self, name, on_elected=None):
+        self.name = name
+        self.key = advisory_lock_key(f'leader:{name}')
+        self.on_elected = on_elected
+        self.leader = False
+        self._connection = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+
+    def is_leader(self):
+        """Returns whether this process leads, taking over if no other process does."""
+        with self._lock:
+            was_leader = self.leader
+            self.leader = self._check() if was_leader else self._acquire()
+            if self.leader and not was_leader:
+                logging.info(f"Elected {self.name} leader.")
+                if self.on_elected:
+                    self.on_elected()
+            elif was_leader and not self.leader:
+                logging.warning(f"Lost {self.name} leadership.")
+            return self.leader
+
+    def release(self):
+        """Gives up leadership, so another replica takes over without waiting for a timeout."""
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.key})
+                except Exception as e:
+                    logging.error(f"Error releasing {self.name} leadership: {e}")
+            self._close()
+            self.leader = False
+
+    def _acquire(self):
+        if not LEADER_ELECTION:
+            return True
+        try:
+            engine = get_engine()
+            if engine.dialect.name == 'postgresql':
+                self._connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+                acquired = self._connection.execute(
+                    text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key}
+                ).scalar()
+            else:
+                import fcntl
+                root, extension = os.path.splitext(LEADER_LOCK_FILE)
+                self._lock_file = open(f'{root}.{self.name}{extension}', 'a')
+                try:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    acquired = True
+                except BlockingIOError:
+                    acquired = False
+        except Exception as e:
+            logging.error(f"Error acquiring {self.name} leadership: {e}")
+            acquired = False
+        if not acquired:
+            self._close()
+        return acquired
+
+    def _check(self):
+        """Confirms the lock connection is alive; the server drops the lock with it."""
+        if self._connection is None:
+            return True
+        try:
+            self._connection.execute(text('SELECT 1'))
+            return True
+        except Exception as e:
+            logging.error(f"Leader lock connection failed: {e}")
+            self._close()
+            return False
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.invalidate()
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+def reload_leader_caches():
+    """Reloads the caches a previous leader may have made stale while this process followed."""
+    schedule_index.clear()
+    warm_schedule_index()
+    subscriber_index.load()
+
+# The scrape leader polls the sources and the inbox leader reads the inbox; every replica delivers the outbox
+scrape_leader = LeaderElection('scrape', on_elected=reload_leader_caches)
+inbox_leader = LeaderElection('inbox')
+
+def leader_only(job, leader=scrape_leader):
+    """Wraps a job so it only runs on the given leader, the scrape leader by default."""
+    def run_if_leader(*args):
+        if leader.is_leader():
+            return job(*args)
+    return run_if_leader
+
+# ---------------------------------------
+# Retention
+# ---------------------------------------
+
+PARTITION_NAME_PATTERN = re.compile(r'schedule_entries_(\d{4})(\d{2})')
+
+def retention_cutoff(today=None):
+    """Returns the oldest date that is kept, or None when SCHEDULE_RETENTION_DAYS is 0."""
+    if SCHEDULE_RETENTION_DAYS <= 0:
+        return None
+    return (today or datetime.now().date()) - timedelta(days=SCHEDULE_RETENTION_DAYS)
+
+def next_month(month):
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def partition_name(month):
+    return f'schedule_entries_{month:%Y%m}'
+
+def ensure_schedule_partitions(today=None):
+    """Creates the monthly partitions from the retention cutoff to SCHEDULE_PARTITIONS_AHEAD months ahead.
+
+    Dates outside them land in a default partition, which the batched deletes
+    of the retention job keep small. Returns False if schedule_entries exists
+    but was created without partitioning.
+    """
+    today = today or datetime.now().date()
+    engine = get_engine()
+    with engine.begin() as connection:
+        kind = connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('schedule_entries')")).scalar()
+        if kind != 'p':
+            logging.warning("schedule_entries is not partitioned; recreate the table to use SCHEDULE_PARTITIONING.")
+            return False
+        connection.execute(text('CREATE TABLE IF NOT EXISTS schedule_entries_default PARTITION OF schedule_entries DEFAULT'))
+
+    month = (retention_cutoff(today) or today).replace(day=1)
+    last = today.replace(day=1)
+    for _ in range(SCHEDULE_PARTITIONS_AHEAD):
+        last = next_month(last)
+    while month <= last:
+        try:
+            # One transaction per partition, so a failing one doesn't hold back the others
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF schedule_entries '
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+                ))
+        except Exception as e:
+            # E.g. the default partition already holds rows of that month
+            logging.error(f"Error creating partition {partition_name(month)}: {e}")
+        month = next_month(month)
+    return True
+
+def drop_expired_partitions(cutoff):
+    """Detaches and drops the monthly partitions that end on or before cutoff; returns their names."""
+    engine = get_engine()
+    with engine.connect() as connection:
+        names = connection.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass('schedule_entries')"
+        )).scalars().all()
+
+    dropped = []
+    for name in sorted(names):
+        match = PARTITION_NAME_PATTERN.fullmatch(name)
+        if not match or next_month(datetime(int(match.group(1)), int(match.group(2)), 1).date()) > cutoff:
+            continue
+        # Detaching only takes a brief lock on the parent, unlike deleting a month of rows
+        with engine.begin() as connection:
+            connection.execute(text(f'ALTER TABLE schedule_entries DETACH PARTITION {name}'))
+            connection.execute(text(f'DROP TABLE {name}'))
+        dropped.append(name)
+    return dropped
+
+def delete_in_batches(table, *conditions):
+    """Deletes matching rows RETENTION_BATCH_SIZE at a time, each batch in its own short transaction.
+
+    Returns the number of deleted rows.
+    """
+    batch = select(table.c.id).where(*conditions).limit(RETENTION_BATCH_SIZE)
+    stmt = delete(table).where(*conditions, table.c.id.in_(batch.scalar_subquery()))
+    engine = get_engine()
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            count = connection.execute(stmt).rowcount
+        deleted += count
+        if count < RETENTION_BATCH_SIZE:
+            return deleted
+
+def purge_expired_data():
+    """Deletes schedule entries older than SCHEDULE_RETENTION_DAYS and the outbox rows queued for them.
+
+    On a partitioned table whole months are dropped first; the remaining
+    rows, such as the older part of the cutoff month, are deleted in batches.
+    """
+    if SCHEDULE_PARTITIONED:
+        ensure_schedule_partitions()
+    cutoff = retention_cutoff()
+    if cutoff is None:
+        return
+
+    try:
+        with timed('retention'):
+            dropped = drop_expired_partitions(cutoff) if SCHEDULE_PARTITIONED else []
+            entries = delete_in_batches(ScheduleEntry.__table__, ScheduleEntry.date < cutoff)
+            outbox = delete_in_batches(
+                OutboxMessage.__table__, OutboxMessage.created_at < datetime(cutoff.year, cutoff.month, cutoff.day)
+            )
+    except Exception as e:
+        logging.error(f"Error purging data older than {cutoff}: {e}")
+        return
+
+    schedule_index.forget(cutoff)
+    rows_purged_total.inc(entries, table='schedule_entries')
+    rows_purged_total.inc(outbox, table='outbox')
+    if dropped:
+        logging.info(f"Dropped expired partitions: {', '.join(dropped)}.")
+    logging.info(f"Purged {entries} schedule entries and {outbox} outbox rows older than {cutoff}.")
 
 # ---------------------------------------
 # Scheduler
 # ---------------------------------------
 
+# Roles a process can take: polling the sources, reading the inbox and delivering the outbox
+ROLES = ('scrape', 'inbox', 'deliver')
+
+# Consecutive failures and checks left to skip per source id
+source_backoff = {}
+
+# One semaphore per host, so sources sharing a server don't overload it
+host_slots = {}
+host_slots_lock = threading.Lock()
+
 def check_website():
-    """Checks the website for updates and processes new entries or updates existing ones."""
+    """Checks every enabled source for updates, fetching up to FETCH_CONCURRENCY of them at once."""
     logging.info("Checking website for updates...")
-    html = fetch_webpage(URL)
-    if html is None:
-        logging.error("Failed to fetch webpage.")
+    sources = [source for source in load_sources() if source_due(source.id)]
+    if not sources:
         return
+    with ThreadPoolExecutor(max_workers=min(FETCH_CONCURRENCY, len(sources))) as executor:
+        list(executor.map(check_source, sources))
 
-    schedules = parse_html(html)
-    session = SessionLocal()
+def check_source(source):
+    """Fetches one source and processes its entries."""
+    with host_slot(source.url):
+        result = fetch_if_changed(source.url, load_fetch_state(source.url))
+    process_fetch_result(source, result)
 
-    for date_str, entries in schedules.items():
-        date_obj = parse_date(date_str)
-        if date_obj is None:
-            continue
+def load_sources():
+    """Returns the enabled sources, detached from their session."""
+    session = SessionLocal()
+    try:
+        return session.query(Source).filter(Source.enabled.is_(True)).order_by(Source.id).all()
+    finally:
+        session.close()
 
-        new_entries = []
-        updated_entries = []
+def host_slot(url):
+    """Returns the semaphore limiting concurrent requests to the host of a URL."""
+    host = urlsplit(url).netloc
+    with host_slots_lock:
+        slot = host_slots.get(host)
+        if slot is None:
+            slot = host_slots[host] = threading.BoundedSemaphore(FETCH_PER_HOST_LIMIT)
+        return slot
+
+def source_due(source_id):
+    """Checks whether a source should be polled now, counting down the checks it is backing off."""
+    backoff = source_backoff.get(source_id)
+    if backoff and backoff[1] > 0:
+        backoff[1] -= 1
+        return False
+    return True
+
+def record_source_result(source_id, failed):
+    """Doubles the checks a failing source skips, up to SOURCE_MAX_SKIPPED_CHECKS, and resets it on success."""
+    if not failed:
+        source_backoff.pop(source_id, None)
+        return
+    failures = source_backoff.get(source_id, [0, 0])[0] + 1
+    skipped = min(2 ** (failures - 1) - 1, SOURCE_MAX_SKIPPED_CHECKS)
+    source_backoff[source_id] = [failures, skipped]
+    logging.warning(f"Source {source_id} failed {failures} times in a row, skipping {skipped} checks.")
 
-        for entry_data in entries:
-            # Skip entries that have missing critical information
-            if not entry_data['lesson'] or not entry_data['class'] or not entry_data['missing_teacher']:
-                continue
+def load_fetch_state(url):
+    """Returns the stored FetchState of a URL, detached from its session, or None."""
+    session = SessionLocal()
+    try:
+        return session.get(FetchState, url)
+    finally:
+        session.close()
 
-            existing_entry = session.query(ScheduleEntry).filter_by(
-                date=date_obj,
-                lesson=entry_data['lesson'],
-                class_name=entry_data['class'],
-                missing_teacher=entry_data['missing_teacher']
-            ).first()
-
-            if not existing_entry:
-                # Add new entry
-                entry = ScheduleEntry(
-                    date=date_obj,
-                    stand_in_teacher=entry_data['stand_in_teacher'],
-                    lesson=entry_data['lesson'],
-                    class_name=entry_data['class'],
-                    subject=entry_data['subject'],
-                    room=entry_data['room'],
-                    missing_teacher=entry_data['missing_teacher'],
-                    comment=entry_data['comment']
-                )
-                session.add(entry)
-                new_entries.append(entry)
-                logging.info(f"New entry added: {entry_data}")
+def process_fetch_result(source, result):
+    """Stores the outcome of a source's fetch and notifies clients about new, updated and removed entries."""
+    record_source_result(source.id, result.status == 'failed')
+    with poll_stats_lock:
+        poll_stats[result.status] += 1
+    polls_total.inc(status=result.status)
+    logging.info(
+        f"Polls: {poll_stats['changed']} processed, "
+        f"{poll_stats['not_modified'] + poll_stats['unchanged']} skipped "
+        f"({poll_stats['not_modified']} not modified, {poll_stats['unchanged']} unchanged), "
+        f"{poll_stats['failed']} failed"
+    )
+    if result.status == 'failed':
+        logging.error(f"Failed to fetch webpage of {source.id}.")
+        return
+    if SNAPSHOT_DIR:
+        try:
+            if result.status == 'changed':
+                archive_snapshot(source, result.html)
             else:
-                # Check for updates
-                changes = []
-                if existing_entry.stand_in_teacher != entry_data['stand_in_teacher']:
-                    existing_entry.stand_in_teacher = entry_data['stand_in_teacher']
-                    changes.append('stand_in_teacher')
-                if existing_entry.room != entry_data['room']:
-                    existing_entry.room = entry_data['room']
-                    changes.append('room')
-                if existing_entry.comment != entry_data['comment']:
-                    existing_entry.comment = entry_data['comment']
-                    changes.append('comment')
-                if changes:
-                    session.commit()  # Commit after updating the entry
-                    updated_entries.append((existing_entry, changes))
-                    logging.info(f"Entry updated: {entry_data}, Changes: {changes}")
-
-        # Commit session after processing all entries
-        session.commit()
+                archive_poll(source, result.status)
+        except Exception as e:
+            logging.error(f"Error archiving snapshot of {source.id}: {e}")
+    if result.status == 'not_modified':
+        return
 
-        # Notify clients about new and updated entries
-        if new_entries:
-            notify_clients(new_entries, is_new=True)
-        if updated_entries:
-            updated_entries_list = [entry for entry, _ in updated_entries]
-            notify_clients(updated_entries_list, is_new=False)
+    new_entries = []
+    updated_entries = []
+    removed_entries = []
 
-    session.close()
-    logging.info("Website check complete.")
+    try:
+        with session_scope() as session:
+            state = session.get(FetchState, source.url)
+            if state is None:
+                state = FetchState(url=source.url)
+                session.add(state)
+            # Keep the validators fresh even when the body hash says nothing changed
+            state.etag = result.etag
+            state.last_modified = result.last_modified
+            if result.status == 'unchanged':
+                return
+
+            schedules = parse_html(result.html)
+            rows_parsed_total.inc(sum(map(len, schedules.values())), source=source.id)
+            for date_str, entries in schedules.items():
+                date_obj = parse_date(date_str)
+                if date_obj is None:
+                    continue
+
+                date_new, date_updated, date_removed = sync_schedule_date(session, source.id, date_obj, entries)
+                new_entries.extend(date_new)
+                updated_entries.extend(date_updated)
+                removed_entries.extend(date_removed)
+
+            # Queue notifications in the same transaction, so no change is committed without them
+            notify_clients(new_entries, 'new', session)
+            notify_clients(updated_entries, 'updated', session)
+            notify_clients(removed_entries, 'cancelled', session)
+
+            # Commit all dates of the poll, the notifications and the new page hash in one transaction
+            state.content_hash = result.content_hash
+            with timed('schedule_commit'):
+                session.commit()
+    except Exception as e:
+        logging.error(f"Error storing schedule entries of {source.id}: {e}")
+        return
 
-def start_scheduler():
-    """Starts the scheduler to run tasks at specified intervals."""
-    # debugging
-    check_website()
-    read_emails()
+    schedule_index.update(new_entries + updated_entries)
+    schedule_index.discard(removed_entries)
+    rows_changed_total.inc(len(new_entries), change='new')
+    rows_changed_total.inc(len(updated_entries), change='updated')
+    rows_changed_total.inc(len(removed_entries), change='removed')
+    logging.info(f"Website check of {source.id} complete.")
+
+def start_scheduler(roles=ROLES):
+    """Starts the scheduler to run the jobs of the given roles at specified intervals."""
+    inbox_stop = None
+    if 'scrape' in roles:
+        # Clients may register on another replica, so pick up their changes before each check
+        schedule.every(CHECK_INTERVAL).minutes.do(leader_only(subscriber_index.refresh))
+        schedule.every(CHECK_INTERVAL).minutes.do(leader_only(check_website))
+        schedule.every(RETENTION_INTERVAL).hours.do(leader_only(purge_expired_data))
+    if 'inbox' in roles:
+        if IMAP_IDLE:
+            inbox_stop = start_inbox_watcher()
+        else:
+            schedule.every(EMAIL_CHECK_INTERVAL).minutes.do(leader_only(read_emails, inbox_leader))
+    if 'deliver' in roles:
+        schedule.every(OUTBOX_POLL_INTERVAL).seconds.do(deliver_outbox)
+    schedule.every(CHECK_INTERVAL).minutes.do(log_stats)
 
-    schedule.every(CHECK_INTERVAL).minutes.do(check_website)
-    schedule.every(EMAIL_CHECK_INTERVAL).minutes.do(read_emails)
+    logging.info(f"Scheduler started with roles: {', '.join(sorted(roles))}.")
 
-    logging.info("Scheduler started.")
+    try:
+        # The first check, inbox read and delivery run right away, then on their intervals
+        schedule.run_all()
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+    finally:
+        if inbox_stop is not None:
+            inbox_stop.set()
+        scrape_leader.release()
+        inbox_leader.release()
+        dispatcher.stop(timeout=30)
+        smtp_pool.close()
+
+def log_stats():
+    """Logs the notification queue depth, dispatch latency, subscriber index usage and leadership."""
+    stats = dispatcher.stats()
+    logging.info(
+        f"Dispatcher: queue depth {stats['queue_depth']}, retrying {stats['retrying']}, "
+        f"sent {stats['sent']}, failed {stats['failed']}, "
+        f"latency avg {stats['latency_avg']:.2f}s max {stats['latency_max']:.2f}s"
+    )
+    stats = subscriber_index.stats()
+    logging.info(
+        f"Subscriber index: {stats['clients']} clients, {stats['keys']} rule keys, "
+        f"{stats['hits']} hits, {stats['misses']} misses"
+    )
+    logging.info(
+        f"Outbox: {outbox_stats['claimed']} rows claimed, {outbox_stats['sent']} messages sent, "
+        f"{outbox_stats['failed']} failed, {outbox_stats['skipped']} rows skipped, "
+        f"{outbox_stats['expired']} claims expired before sending"
+    )
+    logging.info(
+        f"Scrape leader: {'this replica' if scrape_leader.leader else 'another replica'}, "
+        f"inbox leader: {'this replica' if inbox_leader.leader else 'another replica'}"
+    )
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+# Hungarian month names and the abbreviations the page sometimes uses, e.g. 'okt.' or 'szept.'
+HUNGARIAN_MONTHS = {
+    'január': 1, 'jan': 1,
+    'február': 2, 'febr': 2, 'feb': 2,
+    'március': 3, 'márc': 3, 'már': 3,
+    'április': 4, 'ápr': 4,
+    'május': 5, 'máj': 5,
+    'június': 6, 'jún': 6,
+    'július': 7, 'júl': 7,
+    'augusztus': 8, 'aug': 8,
+    'szeptember': 9, 'szept': 9, 'szep': 9,
+    'október': 10, 'okt': 10,
+    'november': 11, 'nov': 11,
+    'december': 12, 'dec': 12,
+}
+HUNGARIAN_WEEKDAYS = (
+    'hétfő', 'kedd', 'szerda', 'csütörtök', 'péntek', 'szombat', 'vasárnap',
+    'h', 'k', 'sze', 'cs', 'p', 'szo', 'v'
+)
+
+def regex_alternation(words):
+    """Returns a regex alternation of words, longest first so prefixes don't shadow them."""
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+# '2024. október 19.', '2024. okt. 19., szombat', 'szombat, 2024. 10. 19.' and the like. Matched at the
+# start of the caption; what follows the day, such as the weekday or '(A hét)', is ignored.
+DATE_PATTERN = re.compile(
+    rf'(?:(?:{regex_alternation(HUNGARIAN_WEEKDAYS)})\.?,?\s+)?'
+    rf'(?P<year>\d{{4}})\.\s*(?P<month>{regex_alternation(HUNGARIAN_MONTHS)}|\d{{1,2}})\.?\s*(?P<day>\d{{1,2}})(?!\d)',
+    re.IGNORECASE
+)
+
+# Cached result of a caption that is not a date
+INVALID_DATE = object()
+
+date_cache = LRUCache(DATE_CACHE_SIZE)
+date_errors = LRUCache(DATE_CACHE_SIZE)  # caption -> (monotonic time last logged, repeats suppressed since)
 
+@timed('parse_date')
 def parse_date(date_str):
-    """Parses date string to a datetime.date object using a replace dictionary."""
-    # Replace dictionary for Hungarian to English month names
-    replace_dict = {
-        'január': 'January',
-        'február': 'February',
-        'március': 'March',
-        'április': 'April',
-        'május': 'May',
-        'június': 'June',
-        'július': 'July',
-        'augusztus': 'August',
-        'szeptember': 'September',
-        'október': 'October',
-        'november': 'November',
-        'december': 'December'
-    }
+    """Parses a Hungarian date caption to a datetime.date object, memoized per caption."""
+    date_obj = date_cache.get(date_str)
+    if date_obj is None:
+        date_obj = parse_hungarian_date(date_str)
+        date_cache.put(date_str, date_obj)
+    if date_obj is INVALID_DATE:
+        log_date_error(date_str)
+        return None
+    return date_obj
+
+def parse_hungarian_date(date_str):
+    """Parses a date caption with DATE_PATTERN; returns INVALID_DATE if it is not a valid date."""
+    match = DATE_PATTERN.match(date_str.strip())
+    if match is None:
+        return INVALID_DATE
+    month = match.group('month')
+    month = int(month) if month.isdigit() else HUNGARIAN_MONTHS[month.lower()]
+    try:
+        return datetime(int(match.group('year')), month, int(match.group('day'))).date()
+    except ValueError:
+        return INVALID_DATE
+
+def log_date_error(date_str):
+    """Logs an unparsable caption at most once per DATE_ERROR_LOG_INTERVAL."""
+    now = time.monotonic()
+    last_logged, suppressed = date_errors.get(date_str) or (None, 0)
+    if last_logged is not None and now - last_logged < DATE_ERROR_LOG_INTERVAL:
+        date_errors.put(date_str, (last_logged, suppressed + 1))
+        return
+    date_errors.put(date_str, (now, 0))
+    repeats = f" ({suppressed} repeats suppressed)" if suppressed else ""
+    logging.error(f"Error parsing date '{date_str}'{repeats}")
+
+# ---------------------------------------
+# Async Runtime
+# ---------------------------------------
+
+class AsyncNotificationDispatcher(NotificationDispatcher):
+    """Delivers queued notifications on asyncio worker tasks.
+
+    Jobs whose function is listed in senders are delivered by awaiting the
+    coroutine function it maps to with the job's arguments; other jobs run
+    their blocking function in the default executor. submit() may be called
+    from any thread.
+    """
+
+    def __init__(self, senders=None, **kwargs):
+        super().__init__(**kwargs)
+        self.senders = senders or {}
+        self._loop = None
+        self._tasks = []
+
+    def start(self):
+        """Starts the worker tasks on the running event loop."""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [self._loop.create_task(self._run()) for _ in range(self.workers)]
+        logging.info(f"Async notification dispatcher started with {self.workers} workers.")
+
+    async def shutdown(self, timeout=None):
+        """Lets the workers drain the queue and waits for them to exit."""
+        tasks, self._tasks = self._tasks, []
+        # Let jobs submitted from other threads reach the queue ahead of the sentinels
+        await asyncio.sleep(0)
+        for _ in tasks:
+            self._queue.put_nowait(None)
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def submit(self, provider, func, *args):
+        """Queues func(*args) for delivery through the given provider."""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, NotificationJob(provider, func, args))
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            bucket = self._buckets.get(job.provider)
+            if bucket:
+                await asyncio.sleep(bucket.reserve())
+            try:
+                sender = self.senders.get(job.func)
+                if sender:
+                    await sender(*job.args)
+                else:
+                    await asyncio.to_thread(job.func, *job.args)
+            except Exception as e:
+                self._retry(job, e)
+            else:
+                self._record_success(job)
+
+    def _requeue_later(self, job, delay):
+        self._loop.call_later(delay, self._requeue, job)
+
+    def _requeue(self, job):
+        with self._lock:
+            self._retrying -= 1
+        self._queue.put_nowait(job)
+
+class AsyncSMTPConnectionPool:
+    """asyncio counterpart of SMTPConnectionPool built on aiosmtplib."""
+
+    def __init__(self, host, port, username, password, size=4, max_messages=100, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        import aiosmtplib
+
+        server = aiosmtplib.SMTP(hostname=self.host, port=self.port, start_tls=SMTP_STARTTLS)
+        await server.connect()
+        try:
+            await server.login(self.username, self.password)
+        except Exception:
+            await self._quit(server)
+            raise
+        return PooledSMTPConnection(server)
+
+    async def _quit(self, server):
+        try:
+            await server.quit()
+        except Exception:
+            server.close()
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if time.monotonic() - conn.last_used < self.idle_timeout:
+                    return conn
+                await self._quit(conn.server)
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _release(self, conn, discard=False):
+        try:
+            if discard or conn.sent >= self.max_messages:
+                await self._quit(conn.server)
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    async def send_message(self, msg):
+        """Sends a message over a pooled connection, reconnecting once if the server hung up."""
+        import aiosmtplib
+
+        for attempt in range(2):
+            conn = await self._acquire()
+            try:
+                await conn.server.send_message(msg)
+            except aiosmtplib.SMTPServerDisconnected:
+                await self._release(conn, discard=True)
+                if attempt:
+                    raise
+                logging.info("SMTP connection was closed by the server, reconnecting.")
+                continue
+            except BaseException:
+                await self._release(conn, discard=True)
+                raise
+            conn.sent += 1
+            await self._release(conn)
+            return
+
+    async def close(self):
+        """Closes all idle connections."""
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._quit(conn.server)
 
-    # Replace Hungarian month names with English equivalents
-    for hu_month, en_month in replace_dict.items():
-        date_str = date_str.replace(hu_month, en_month)
+async def send_email_async(pool, to_email, subject, html_content, raise_errors=False, text_content=None):
+    """Sends an email with HTML content over an AsyncSMTPConnectionPool."""
+    msg = build_email(to_email, subject, html_content, text_content)
 
     try:
-        date_obj = datetime.strptime(date_str, '%Y. %B %d.').date()
-        return date_obj
-    except ValueError as e:
-        logging.error(f"Error parsing date '{date_str}': {e}")
-        return None
+        with timed('send_email'):
+            await pool.send_message(msg)
+        emails_total.inc(result='sent')
+        logging.debug(f"Sent email to {to_email} with subject '{subject}'.")
+    except Exception as e:
+        emails_total.inc(result='failed')
+        logging.error(f"Error sending email to {to_email}: {e}")
+        if raise_errors:
+            raise
+
+async def send_outbox_message_async(pool, client_email, outbox_ids, lease, message):
+    """send_outbox_message counterpart that sends over an AsyncSMTPConnectionPool."""
+    lease = await asyncio.to_thread(renew_outbox_claim, outbox_ids, lease)
+    if lease is None:
+        outbox_stats['expired'] += 1
+        return
+    try:
+        await send_email_async(pool, client_email, "Schedule Update", message.html, True, message.text)
+    except Exception as e:
+        await asyncio.to_thread(record_outbox_failure, outbox_ids, lease, e)
+        outbox_stats['failed'] += 1
+    else:
+        await asyncio.to_thread(mark_outbox_sent, outbox_ids, lease)
+        outbox_stats['sent'] += 1
+
+async def fetch_if_changed_async(http, url, state=None):
+    """aiohttp counterpart of fetch_if_changed."""
+    import aiohttp
+
+    try:
+        with timed('fetch_if_changed'):
+            async with http.get(url, headers=conditional_headers(state)) as response:
+                if response.status == 304:
+                    logging.info(f"Webpage not modified: {url}")
+                    return FetchResult('not_modified')
+                response.raise_for_status()
+                body = await response.read()
+                result = hash_fetched_body(url, state, body, response.headers)
+                if result.status == 'changed':
+                    result.html = body.decode(response.get_encoding(), errors='replace')
+                return result
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.error(f"Error fetching webpage: {e}")
+        return FetchResult('failed')
+
+async def check_website_async(http):
+    """Checks every enabled source with aiohttp, running the database work in the default executor.
+
+    The session's connector caps concurrent and per-host requests.
+    """
+    if not await asyncio.to_thread(scrape_leader.is_leader):
+        return
+    logging.info("Checking website for updates...")
+    sources = await asyncio.to_thread(load_sources)
+    await asyncio.gather(*(check_source_async(http, source) for source in sources if source_due(source.id)))
+
+async def check_source_async(http, source):
+    """Fetches one source with aiohttp and processes its entries."""
+    state = await asyncio.to_thread(load_fetch_state, source.url)
+    result = await fetch_if_changed_async(http, source.url, state)
+    await asyncio.to_thread(process_fetch_result, source, result)
+
+async def run_periodic(name, interval, job, stop):
+    """Runs job every interval seconds until stop is set.
+
+    Runs of a job never overlap; a run that starts late happens once, right
+    away, instead of catching up on every missed interval.
+    """
+    loop = asyncio.get_running_loop()
+    next_run = loop.time()
+    while not stop.is_set():
+        try:
+            await job()
+        except Exception as e:
+            logging.error(f"Error in {name} job: {e}")
+
+        next_run += interval
+        now = loop.time()
+        if now > next_run + interval:
+            logging.info(f"{name} job is running late, coalescing {int((now - next_run) // interval)} missed runs.")
+        next_run = max(next_run, now)
+        try:
+            await asyncio.wait_for(stop.wait(), next_run - now)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_async(roles=ROLES):
+    """Runs the jobs of the given roles as independent asyncio tasks until SIGINT/SIGTERM."""
+    global dispatcher
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = [loop.create_task(run_periodic('stats', CHECK_INTERVAL * 60, lambda: asyncio.to_thread(log_stats), stop))]
+    http = smtp = inbox_stop = None
+    if 'scrape' in roles:
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=FETCH_CONCURRENCY, limit_per_host=FETCH_PER_HOST_LIMIT)
+        http = aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+        async def scrape():
+            # Clients may register on another replica, so pick up their changes before each check
+            await asyncio.to_thread(leader_only(subscriber_index.refresh))
+            await check_website_async(http)
+
+        tasks += [
+            loop.create_task(run_periodic('scrape', CHECK_INTERVAL * 60, scrape, stop)),
+            loop.create_task(run_periodic(
+                'retention', RETENTION_INTERVAL * 3600, lambda: asyncio.to_thread(leader_only(purge_expired_data)), stop
+            )),
+        ]
+    if 'inbox' in roles:
+        if IMAP_IDLE:
+            # The IDLE session blocks on its socket, so it keeps a thread of its own
+            inbox_stop = start_inbox_watcher()
+        else:
+            tasks.append(loop.create_task(run_periodic(
+                'inbox', EMAIL_CHECK_INTERVAL * 60, lambda: asyncio.to_thread(leader_only(read_emails, inbox_leader)), stop
+            )))
+    if 'deliver' in roles:
+        smtp = AsyncSMTPConnectionPool(
+            SMTP_SERVER,
+            SMTP_PORT,
+            BOT_EMAIL,
+            EMAIL_PASSWORD,
+            size=SMTP_POOL_SIZE,
+            max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION,
+            idle_timeout=SMTP_IDLE_TIMEOUT
+        )
+        dispatcher = AsyncNotificationDispatcher(
+            senders={send_outbox_message: lambda *args: send_outbox_message_async(smtp, *args)},
+            workers=NOTIFY_WORKERS,
+            rate_limits={'email': (SMTP_RATE_LIMIT, SMTP_RATE_BURST)},
+            max_retries=NOTIFY_MAX_RETRIES,
+            retry_backoff=NOTIFY_RETRY_BACKOFF
+        )
+        dispatcher.start()
+        tasks.append(loop.create_task(
+            run_periodic('outbox', OUTBOX_POLL_INTERVAL, lambda: asyncio.to_thread(deliver_outbox), stop)
+        ))
+
+    logging.info(f"Async runtime started with roles: {', '.join(sorted(roles))}.")
+    await stop.wait()
+    logging.info("Shutting down, waiting for running jobs to finish...")
+    if inbox_stop is not None:
+        inbox_stop.set()
+    await asyncio.gather(*tasks)
+
+    if http is not None:
+        await http.close()
+    await asyncio.to_thread(scrape_leader.release)
+    await asyncio.to_thread(inbox_leader.release)
+    if smtp is not None:
+        await dispatcher.shutdown(timeout=30)
+        await smtp.close()
+    logging.info("Async runtime stopped.")
 
 # ---------------------------------------
 # Main Entry Point
 # ---------------------------------------
 
-def main():
+def parse_roles(value):
+    """Parses a comma-separated --role value; 'all' stands for every role."""
+    roles = {role.strip() for role in value.split(',')}
+    if 'all' in roles:
+        return set(ROLES)
+    unknown = roles - set(ROLES)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown role(s): {', '.join(sorted(unknown))}")
+    return roles
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in schedule notifier.")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help="run the jobs as asyncio tasks instead of the schedule loop")
+    parser.add_argument('--role', dest='roles', type=parse_roles, default=set(ROLES),
+                        help="comma-separated jobs of this process: scrape, inbox, deliver or all (default)")
+    args = parser.parse_args(argv)
+
     logging.info("Application started.")
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
     init_db()
-    start_scheduler()
+    if 'scrape' in args.roles:
+        register_sources()
+    # The schedule index and subscribers are loaded once this process is elected scrape leader
+    if args.async_mode:
+        asyncio.run(run_async(args.roles))
+    else:
+        start_scheduler(args.roles)
 
 if __name__ == '__main__':
     main()
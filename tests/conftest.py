@@ -0,0 +1,37 @@
+# tests/conftest.py
+
+"""Configures the notifier before the tests import it.
+
+The notifier reads its configuration at import time, so the environment is
+set here: a throwaway SQLite database, no leader election, no metrics
+server and no developer .env.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.run import isolate_environment, reset_database
+
+isolate_environment({
+    'DATABASE_URL': f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='stand-in-tests-'), 'test.db')}",
+    'BOT_EMAIL': 'bot@example.com',
+    'EMAIL_PASSWORD': 'test',
+    'LEADER_ELECTION': 'false',
+    'METRICS_PORT': '0',
+    'LOG_LEVEL': 'WARNING',
+    'SNAPSHOT_DIR': '',
+})
+
+@pytest.fixture
+def database():
+    """Recreates the tables and empties the notifier's in-process indexes; returns the notifier module."""
+    import stand_in_notifier as app
+
+    reset_database(app)
+    return app
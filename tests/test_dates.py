@@ -0,0 +1,69 @@
+# tests/test_dates.py
+
+"""Tests parse_date on the caption formats the school's pages use, and its cached error path."""
+
+import logging
+from datetime import date
+
+import pytest
+
+import stand_in_notifier as app
+
+@pytest.mark.parametrize('caption, expected', [
+    # Full month names, as the page usually shows them
+    ('2024. szeptember 16.', date(2024, 9, 16)),
+    ('2024. október 19.', date(2024, 10, 19)),
+    ('2025. január 2.', date(2025, 1, 2)),
+    ('2024. December 31.', date(2024, 12, 31)),
+    # Abbreviated months, with and without the dot
+    ('2024. okt. 19.', date(2024, 10, 19)),
+    ('2024. szept. 9.', date(2024, 9, 9)),
+    ('2024. szep 9.', date(2024, 9, 9)),
+    ('2025. márc. 3.', date(2025, 3, 3)),
+    ('2025. febr. 28.', date(2025, 2, 28)),
+    # Numeric months
+    ('2024. 10. 19.', date(2024, 10, 19)),
+    ('2024.10.19.', date(2024, 10, 19)),
+    ('2024. 9. 5', date(2024, 9, 5)),
+    # The day of the week before or after the date
+    ('szombat, 2024. 10. 19.', date(2024, 10, 19)),
+    ('Hétfő 2024. szeptember 16.', date(2024, 9, 16)),
+    ('2024. szeptember 16., hétfő', date(2024, 9, 16)),
+    ('2024. okt. 19. szo.', date(2024, 10, 19)),
+    # Anything after the date is ignored
+    ('2024. szeptember 16., hétfő, A hét', date(2024, 9, 16)),
+    ('2024. szeptember 16., hétfő (A hét)', date(2024, 9, 16)),
+    ('2024. szeptember 16. - B hét', date(2024, 9, 16)),
+    ('  2024. szeptember 16.  ', date(2024, 9, 16)),
+    # Not dates
+    ('2024. február 30.', None),
+    ('2024. 13. 1.', None),
+    ('2024. október 123.', None),
+    ('A hét, 2024. szeptember 16.', None),
+    ('Helyettesítések', None),
+    ('', None),
+])
+def test_parse_date(caption, expected):
+    assert app.parse_date(caption) == expected
+
+def test_invalid_caption_is_cached_and_logged_once_per_interval(caplog, monkeypatch):
+    caption = 'Órarendváltozás'
+    with caplog.at_level(logging.ERROR):
+        assert app.parse_date(caption) is None
+        assert app.parse_date(caption) is None
+        assert app.parse_date(caption) is None
+    assert app.date_cache.get(caption) is app.INVALID_DATE
+    assert [record.getMessage() for record in caplog.records] == [f"Error parsing date '{caption}'"]
+
+    # Once the interval has passed, the next error reports the suppressed repeats
+    caplog.clear()
+    monkeypatch.setattr(app, 'DATE_ERROR_LOG_INTERVAL', 0)
+    with caplog.at_level(logging.ERROR):
+        assert app.parse_date(caption) is None
+    assert [record.getMessage() for record in caplog.records] == [f"Error parsing date '{caption}' (2 repeats suppressed)"]
+
+def test_valid_caption_is_parsed_once(monkeypatch):
+    caption = '2026. október 19., hétfő'
+    assert app.parse_date(caption) == date(2026, 10, 19)
+    monkeypatch.setattr(app, 'parse_hungarian_date', lambda date_str: pytest.fail('caption parsed again'))
+    assert app.parse_date(caption) == date(2026, 10, 19)
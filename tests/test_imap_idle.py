@@ -0,0 +1,93 @@
+# tests/test_imap_idle.py
+
+"""Tests push mode, imap_idle and watch_inbox, against the local IMAP stand-in with IDLE."""
+
+import threading
+import time
+from email.message import EmailMessage
+
+import pytest
+
+import stand_in_notifier as app
+from benchmarks.stand_ins import IMAPInbox
+
+def raw_message(subject='HELP'):
+    message = EmailMessage()
+    message['From'] = 'parent@example.com'
+    message['To'] = 'bot@example.com'
+    message['Subject'] = subject
+    message.set_content('')
+    return message.as_bytes()
+
+def deliver_later(inbox, delay=0.2):
+    timer = threading.Timer(delay, inbox.deliver, ([raw_message()],))
+    timer.start()
+    return timer
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+@pytest.fixture
+def inbox(monkeypatch):
+    inbox = IMAPInbox(idle=True)
+    monkeypatch.setattr(app, 'IMAP_SERVER', '127.0.0.1')
+    monkeypatch.setattr(app, 'IMAP_PORT', inbox.port)
+    monkeypatch.setattr(app, 'IMAP_SSL', False)
+    yield inbox
+    inbox.stop()
+
+@pytest.fixture
+def mail(inbox):
+    mail = app.connect_imap()
+    yield mail
+    try:
+        mail.logout()
+    except Exception:
+        pass
+
+def test_new_mail_ends_idle(inbox, mail):
+    assert 'IDLE' in mail.capabilities
+    deliver_later(inbox)
+    start = time.monotonic()
+    assert app.imap_idle(mail, 10) is True
+    assert time.monotonic() - start < 5
+
+def test_timeout_then_idle_again(inbox, mail):
+    assert app.imap_idle(mail, 0.3) is False
+
+    # The session stays usable after the timed-out read
+    deliver_later(inbox)
+    assert app.imap_idle(mail, 10) is True
+    assert [uid for uid, _ in app.fetch_unseen(mail)] == [b'1']
+
+def test_dropped_connection_raises_abort(inbox, mail):
+    threading.Timer(0.2, inbox.drop_connections).start()
+    with pytest.raises(mail.abort):
+        app.imap_idle(mail, 10)
+
+def test_watch_inbox_reconnects_after_drop(inbox, monkeypatch):
+    passes = []
+    monkeypatch.setattr(app, 'process_unseen', lambda mail: passes.append(inbox.sessions))
+    monkeypatch.setattr(app, 'IMAP_IDLE_TIMEOUT', 5)
+
+    stop = app.start_inbox_watcher()
+    try:
+        # The first pass runs right after connecting
+        assert wait_until(lambda: passes == [1])
+
+        # A dropped session is reopened after a 1s backoff, and processed again
+        inbox.drop_connections()
+        assert wait_until(lambda: len(passes) == 2)
+        assert passes[1] == 2
+
+        # New mail reported in IDLE on the new session triggers another pass
+        inbox.deliver([raw_message()])
+        assert wait_until(lambda: len(passes) == 3)
+        assert passes[2] == 2
+    finally:
+        stop.set()
@@ -0,0 +1,71 @@
+# tests/test_leader_election.py
+
+"""Tests LeaderElection with the file lock it uses on databases other than PostgreSQL."""
+
+import pytest
+
+import stand_in_notifier as app
+
+@pytest.fixture
+def elections(tmp_path, monkeypatch):
+    """Creates elections that share one lock file, as replicas on one host do; releases them afterwards."""
+    monkeypatch.setattr(app, 'LEADER_ELECTION', True)
+    monkeypatch.setattr(app, 'LEADER_LOCK_FILE', str(tmp_path / 'notifier.lock'))
+    created = []
+
+    def create(name='scrape'):
+        elected = []
+        election = app.LeaderElection(name, on_elected=lambda: elected.append(True))
+        election.elected = elected
+        created.append(election)
+        return election
+
+    yield create
+    for election in created:
+        election.release()
+
+def test_only_one_replica_leads(elections):
+    first, second = elections(), elections()
+
+    assert first.is_leader()
+    assert not second.is_leader()
+    # Leadership is kept on later checks
+    assert first.is_leader()
+    assert not second.is_leader()
+    assert first.elected == [True]
+    assert second.elected == []
+
+def test_follower_takes_over_after_release(elections):
+    first, second = elections(), elections()
+    assert first.is_leader()
+    assert not second.is_leader()
+
+    first.release()
+    assert not first.leader
+    assert second.is_leader()
+    assert second.elected == [True]
+    assert not first.is_leader()
+
+    # on_elected fires once per takeover, not on every check
+    assert second.is_leader()
+    assert second.elected == [True]
+
+def test_jobs_are_elected_separately(elections):
+    scrape, inbox = elections('scrape'), elections('inbox')
+    assert scrape.is_leader()
+    assert inbox.is_leader()
+
+def test_leader_only_runs_jobs_on_the_leader(elections):
+    first, second = elections(), elections()
+    runs = []
+    job = lambda name: runs.append(name)
+
+    app.leader_only(job, first)('first')
+    app.leader_only(job, second)('second')
+    assert runs == ['first']
+
+def test_every_process_leads_without_leader_election(elections, monkeypatch):
+    monkeypatch.setattr(app, 'LEADER_ELECTION', False)
+    first, second = elections(), elections()
+    assert first.is_leader()
+    assert second.is_leader()
@@ -0,0 +1,242 @@
+# tests/test_outbox.py
+
+"""Tests the notification outbox against the SQLite test database and the SMTP stand-in.
+
+Changes are queued by driving process_fetch_result with rendered pages, and
+delivered by deliver_outbox on a dispatcher of the test's own.
+"""
+
+import email
+import hashlib
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import delete, select, update
+
+import stand_in_notifier as app
+from benchmarks.pages import render_page
+from benchmarks.stand_ins import SMTPSink
+
+DAY = date.today() + timedelta(days=1)
+SOURCE = SimpleNamespace(id='default', url='http://school.example/helyettesites/')
+
+def lesson(**fields):
+    entry = {
+        'stand_in_teacher': 'Kiss Péter', 'lesson': '3', 'class': '9.A', 'subject': 'matematika',
+        'room': '12', 'missing_teacher': 'Nagy Anna', 'comment': '',
+    }
+    entry.update(fields)
+    return entry
+
+def poll(*entries):
+    """Processes a changed page that lists the given entries for DAY."""
+    html = render_page({DAY: list(entries)})
+    app.process_fetch_result(SOURCE, app.FetchResult('changed', html=html, content_hash=hashlib.sha256(html.encode()).hexdigest()))
+
+def unsent():
+    """Returns the (status, fingerprint) of every unsent outbox row, in id order."""
+    with app.SessionLocal() as session:
+        return [
+            (row.status, row.fingerprint)
+            for row in session.execute(
+                select(app.OutboxMessage.status, app.OutboxMessage.fingerprint)
+                .where(app.OutboxMessage.sent_at.is_(None))
+                .order_by(app.OutboxMessage.id)
+            )
+        ]
+
+def mark_all_sent():
+    with app.SessionLocal() as session:
+        session.execute(update(app.OutboxMessage).where(app.OutboxMessage.sent_at.is_(None)).values(sent_at=datetime.now()))
+        session.commit()
+
+def outbox_rows():
+    with app.SessionLocal() as session:
+        return session.scalars(select(app.OutboxMessage).order_by(app.OutboxMessage.id)).all()
+
+def titles(raw_message):
+    """Returns the status titles in the plain-text part of a sent notification."""
+    for part in email.message_from_bytes(raw_message).walk():
+        if part.get_content_type() == 'text/plain':
+            text = part.get_payload(decode=True).decode('utf-8')
+            return [title for title in app.STATUS_TITLES.values() if title in text]
+    return []
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+def fingerprint(entry):
+    return app.schedule_fingerprint(dict(entry, class_name=entry['class']))
+
+@pytest.fixture
+def subscriber(database, monkeypatch):
+    monkeypatch.setattr(app, 'NOTIFY_DIGEST_WINDOW', 0)
+    app.store_client_changes({'anna@example.com': ('Anna', '9.A', 'english', SOURCE.id, [])})
+    return 'anna@example.com'
+
+def test_restored_entry_is_announced_again(subscriber):
+    poll(lesson())
+    assert unsent() == [('new', fingerprint(lesson()))]
+    mark_all_sent()
+
+    poll()
+    assert unsent() == [('cancelled', fingerprint(lesson()))]
+    mark_all_sent()
+
+    # Back on the page with the same fingerprint as the first, already sent announcement
+    poll(lesson())
+    assert unsent() == [('new', fingerprint(lesson()))]
+
+def test_flip_flopping_field_is_announced_every_time(subscriber):
+    poll(lesson(room='A'))
+    mark_all_sent()
+    for room in ('B', 'A', 'B'):
+        poll(lesson(room=room))
+        assert unsent() == [('updated', fingerprint(lesson(room=room)))]
+        mark_all_sent()
+
+def test_duplicate_unsent_row_is_merged(subscriber):
+    poll(lesson())
+    poll()
+    poll(lesson())
+    assert unsent() == [('new', fingerprint(lesson())), ('cancelled', fingerprint(lesson()))]
+
+    # The merged row is claimed after the cancellation, so the entry is announced
+    messages, _, _ = app.claim_outbox(10)
+    assert [message.status for message in messages] == ['cancelled', 'new']
+
+@pytest.fixture
+def sink(subscriber, monkeypatch):
+    """Sends notifications to the SMTP stand-in through a pool and dispatcher of the test's own."""
+    sink = SMTPSink(keep_messages=True)
+    pool = app.SMTPConnectionPool('127.0.0.1', sink.port, 'bot@example.com', 'test', size=2)
+    dispatcher = app.NotificationDispatcher(workers=2)
+    monkeypatch.setattr(app, 'SMTP_STARTTLS', False)
+    monkeypatch.setattr(app, 'smtp_pool', pool)
+    monkeypatch.setattr(app, 'dispatcher', dispatcher)
+    yield sink
+    dispatcher.stop(timeout=10)
+    pool.close()
+    sink.stop()
+
+def deliver():
+    """Runs one delivery and waits until its claimed rows are sent or given back."""
+    app.deliver_outbox()
+    assert wait_until(lambda: all(row.locked_until is None for row in outbox_rows()))
+
+def test_delivers_one_digest_per_client(sink):
+    app.store_client_changes({'bence@example.com': ('Bence', '10.B', 'german', SOURCE.id, [])})
+    poll(lesson(lesson='1'), lesson(lesson='2'), lesson(**{'class': '10.B'}))
+    deliver()
+
+    assert sink.count == 2
+    assert sorted(map(titles, sink.messages)) == [[app.STATUS_TITLES['new']]] * 2
+    assert unsent() == []
+
+def test_new_and_cancelled_cancel_out(sink):
+    skipped = app.outbox_stats['skipped']
+    poll(lesson())
+    poll()
+    deliver()
+
+    assert sink.count == 0
+    assert unsent() == []
+    assert app.outbox_stats['skipped'] == skipped + 2
+
+@pytest.mark.parametrize('pages, status', [
+    # (new, updated) stays new
+    ([[lesson()], [lesson(room='13')]], 'new'),
+    # (updated, cancelled) is a cancellation
+    ([[lesson(room='13')], []], 'cancelled'),
+    # (cancelled, new) of an entry announced before is an update
+    ([[], [lesson()]], 'updated'),
+    # (updated, updated) is one update
+    ([[lesson(room='13')], [lesson(room='14')]], 'updated'),
+], ids=['new-updated', 'updated-cancelled', 'cancelled-new', 'updated-updated'])
+def test_digest_transitions(sink, pages, status):
+    if pages[0] != [lesson()]:
+        # The entry was announced in an earlier digest
+        poll(lesson())
+        mark_all_sent()
+    for entries in pages:
+        poll(*entries)
+    deliver()
+
+    assert sink.count == 1
+    assert titles(sink.messages[0]) == [app.STATUS_TITLES[status]]
+
+def test_skips_unsubscribed_client(sink, subscriber):
+    skipped = app.outbox_stats['skipped']
+    poll(lesson())
+    # Unsubscribed on another replica, which this one's index hasn't noticed
+    with app.SessionLocal() as session:
+        session.execute(delete(app.Client).where(app.Client.email == subscriber))
+        session.commit()
+    app.subscriber_index.remove(subscriber)
+    deliver()
+
+    assert sink.count == 0
+    assert unsent() == []
+    assert app.outbox_stats['skipped'] == skipped + 1
+
+def test_claim_is_held_until_its_lease_expires(sink, subscriber, monkeypatch):
+    poll(lesson())
+    monkeypatch.setattr(app, 'OUTBOX_LEASE', 0)
+    messages, entries, expired_lease = app.claim_outbox(10)
+    outbox_ids = [message.id for message in messages]
+    assert len(outbox_ids) == 1
+
+    # The lease ran out, so another worker claims the row again
+    monkeypatch.setattr(app, 'OUTBOX_LEASE', 300)
+    messages, _, lease = app.claim_outbox(10)
+    assert [message.id for message in messages] == outbox_ids
+    assert app.claim_outbox(10)[0] == []
+
+    # The first claim can neither send nor record anything any more
+    expired = app.outbox_stats['expired']
+    message = app.compose_digest([(entry, 'new') for entry in entries.values()])
+    app.send_outbox_message(subscriber, outbox_ids, expired_lease, message)
+    assert app.outbox_stats['expired'] == expired + 1
+    assert app.renew_outbox_claim(outbox_ids, expired_lease) is None
+    app.record_outbox_failure(outbox_ids, expired_lease, RuntimeError('too late'))
+    app.mark_outbox_sent(outbox_ids, expired_lease)
+    row, = outbox_rows()
+    assert (row.sent_at, row.attempts, row.locked_until) == (None, 0, lease)
+
+    app.send_outbox_message(subscriber, outbox_ids, lease, message)
+    assert sink.wait_for(1, 5)
+    row, = outbox_rows()
+    assert row.sent_at is not None
+    assert row.locked_until is None
+
+def test_failed_sends_back_off_until_max_attempts(sink, monkeypatch):
+    monkeypatch.setattr(app, 'OUTBOX_MAX_ATTEMPTS', 3)
+    poll(lesson())
+    sink.hang_up = True
+
+    for attempt in range(1, 4):
+        before = datetime.now()
+        deliver()
+        row, = outbox_rows()
+        assert row.attempts == attempt
+        assert row.sent_at is None
+        assert row.last_error
+        # OUTBOX_RETRY_BACKOFF seconds, doubled per attempt
+        delay = (row.next_attempt_at - before).total_seconds()
+        assert app.OUTBOX_RETRY_BACKOFF * 2 ** (attempt - 1) <= delay < app.OUTBOX_RETRY_BACKOFF * 2 ** (attempt - 1) + 5
+        # Skip the wait for the retry
+        with app.SessionLocal() as session:
+            session.execute(update(app.OutboxMessage).values(next_attempt_at=datetime.now()))
+            session.commit()
+
+    # Out of attempts: the row is never claimed again, even once the relay accepts mail
+    sink.hang_up = False
+    assert app.claim_outbox(10)[0] == []
+    assert sink.count == 0
@@ -0,0 +1,47 @@
+# tests/test_parsers.py
+
+"""Checks that every HTML parser extracts the same schedules as the BeautifulSoup one.
+
+The fixtures under fixtures/pages/ are table.live pages with the markup the
+parsers have to agree on: entities and &nbsp;, inline tags and comments,
+rows that don't have 7 cells, thead rows and nested tables.
+"""
+
+import glob
+import os
+
+import pytest
+
+import stand_in_notifier as app
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+PAGES = sorted(glob.glob(os.path.join(PAGES_DIR, '*.html')))
+
+def read_page(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+@pytest.fixture(params=PAGES, ids=os.path.basename)
+def page(request):
+    return read_page(request.param)
+
+def test_fixtures_have_schedules():
+    # Guards against an empty glob, which would pass every comparison below
+    assert PAGES
+    for path in PAGES:
+        assert any(app.parse_html_bs4(read_page(path)).values()), path
+
+def test_stream_matches_bs4(page):
+    assert app.parse_html_stream(page) == app.parse_html_bs4(page)
+
+def test_lxml_matches_bs4(page):
+    pytest.importorskip('lxml')
+    assert app.parse_html_lxml(page) == app.parse_html_bs4(page)
+
+def test_entities_and_whitespace():
+    schedules = app.parse_html_stream(read_page(os.path.join(PAGES_DIR, 'entities.html')))
+    entries = schedules['2026. október 19., hétfő']
+    assert entries[0]['stand_in_teacher'] == 'Kovács & Tóth'
+    assert entries[1]['stand_in_teacher'] == 'Szabó Gábor'
+    assert entries[1]['room'] == '42'
+    assert entries[1]['comment'] == ''
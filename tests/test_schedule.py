@@ -0,0 +1,155 @@
+# tests/test_schedule.py
+
+"""Tests the schedule diff against the SQLite test database.
+
+Pages are rendered from entry dicts or read from fixtures/pages/, and fed to
+process_fetch_result, or served by the page stand-in to check_website.
+"""
+
+import hashlib
+import os
+from contextlib import contextmanager
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event, select
+
+import clear_day
+import stand_in_notifier as app
+from benchmarks.pages import generate_schedule, render_page
+from benchmarks.run import reset_database
+from benchmarks.stand_ins import SchedulePageServer
+
+DAY = date.today() + timedelta(days=1)
+PATH = '/helyettesites/'
+SOURCE = SimpleNamespace(id='school', url='http://school.example/helyettesites/')
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+def lesson(**fields):
+    entry = {
+        'stand_in_teacher': 'Kiss Péter', 'lesson': '3', 'class': '9.A', 'subject': 'matematika',
+        'room': '12', 'missing_teacher': 'Nagy Anna', 'comment': '',
+    }
+    entry.update(fields)
+    return entry
+
+def poll(html):
+    """Processes a changed page and returns the number of new, updated and removed entries."""
+    before = {change: app.rows_changed_total.value(change=change) for change in ('new', 'updated', 'removed')}
+    app.process_fetch_result(SOURCE, app.FetchResult('changed', html=html, content_hash=hashlib.sha256(html.encode()).hexdigest()))
+    return tuple(app.rows_changed_total.value(change=change) - before[change] for change in ('new', 'updated', 'removed'))
+
+def stored():
+    """Returns {(lesson, class): (room, fingerprint, removed)} of the stored entries of DAY."""
+    with app.SessionLocal() as session:
+        return {
+            (entry.lesson, entry.class_name): (entry.room, entry.fingerprint, entry.removed_at is not None)
+            for entry in session.scalars(select(app.ScheduleEntry).where(app.ScheduleEntry.date == DAY))
+        }
+
+@contextmanager
+def counted_statements():
+    """Counts the SQL statements executed in the block, an executemany counting once."""
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(app.get_engine(), 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        event.remove(app.get_engine(), 'before_cursor_execute', listener)
+
+def outbox():
+    """Returns the (status, lesson) of every notification queued for a stored entry, in id order."""
+    with app.SessionLocal() as session:
+        return session.execute(
+            select(app.OutboxMessage.status, app.ScheduleEntry.lesson)
+            .join(app.ScheduleEntry, app.ScheduleEntry.id == app.OutboxMessage.entry_id)
+            .order_by(app.OutboxMessage.id)
+        ).all()
+
+@pytest.fixture
+def pages(database, monkeypatch):
+    """Serves the school's page from the stand-in and registers a subscriber of class 9.A."""
+    pages = SchedulePageServer()
+    monkeypatch.setattr(app, 'SOURCES', f'school={pages.url(PATH)}')
+    monkeypatch.setattr(app, 'DEFAULT_SOURCE', 'school')
+    monkeypatch.setattr(app, 'NOTIFY_DIGEST_WINDOW', 0)
+    app.register_sources()
+    app.store_client_changes({'anna@example.com': ('Anna', '9.A', 'english', 'school', [])})
+    yield pages
+    pages.stop()
+
+def test_cleared_entries_are_announced_again(pages):
+    pages.set_page(PATH, render_page({DAY: [lesson(lesson='1'), lesson(lesson='2')]}))
+    app.check_website()
+    assert outbox() == [('new', '1'), ('new', '2')]
+
+    # Cleared while the notifier runs, so its schedule index still holds the entries
+    clear_day.clear_entries(DAY, DAY, 'school')
+    assert outbox() == []
+    app.check_website()
+    assert outbox() == [('new', '1'), ('new', '2')]
+
+def test_recorded_page_is_stored(database):
+    with open(os.path.join(PAGES_DIR, 'plain.html'), encoding='utf-8') as f:
+        html = f.read()
+    assert poll(html) == (12, 0, 0)
+    with app.SessionLocal() as session:
+        entries = session.scalars(select(app.ScheduleEntry)).all()
+    assert len(entries) == 12
+    assert {entry.date for entry in entries} == {date(2026, 10, 19), date(2026, 10, 20)}
+    assert all(entry.fingerprint == app.schedule_fingerprint(entry) for entry in entries)
+
+    # The same page again touches nothing
+    assert poll(html) == (0, 0, 0)
+
+def test_new_updated_and_removed_entries(database):
+    assert poll(render_page({DAY: [lesson(lesson='1'), lesson(lesson='2'), lesson(lesson='3')]})) == (3, 0, 0)
+    first = stored()
+
+    assert poll(render_page({DAY: [lesson(lesson='1'), lesson(lesson='2', room='99'), lesson(lesson='4')]})) == (1, 1, 1)
+    second = stored()
+    assert second[('1', '9.A')] == first[('1', '9.A')]
+    assert second[('2', '9.A')] == ('99', app.schedule_fingerprint(dict(lesson(lesson='2', room='99'), class_name='9.A')), False)
+    assert second[('3', '9.A')][2] is True
+    assert second[('4', '9.A')][2] is False
+
+def test_removed_entry_is_revived(database):
+    assert poll(render_page({DAY: [lesson()]})) == (1, 0, 0)
+    with app.SessionLocal() as session:
+        entry_id = session.scalar(select(app.ScheduleEntry.id))
+    assert poll(render_page({DAY: []})) == (0, 0, 1)
+    assert stored()[('3', '9.A')][2] is True
+
+    # The soft-deleted row is brought back, and announced as new
+    assert poll(render_page({DAY: [lesson(room='99')]})) == (1, 0, 0)
+    with app.SessionLocal() as session:
+        entry = session.scalars(select(app.ScheduleEntry)).one()
+    assert (entry.id, entry.room, entry.removed_at) == (entry_id, '99', None)
+
+    # A restart sees the same state as the index
+    app.schedule_index.clear()
+    assert poll(render_page({DAY: [lesson(room='99')]})) == (0, 0, 0)
+
+def test_statements_per_date_do_not_depend_on_rows(database):
+    def changed(schedule):
+        # On every date one entry is updated, one removed and one added
+        return {
+            day: [dict(entries[0], room='999')] + entries[2:] + [dict(entries[0], missing_teacher='Új Tanár')]
+            for day, entries in schedule.items()
+        }
+
+    counts = []
+    for rows in (15, 300):
+        reset_database(app)
+        schedule = generate_schedule(rows, dates=3, start=DAY, seed=rows)
+        with counted_statements() as initial:
+            assert poll(render_page(schedule)) == (rows, 0, 0)
+        with counted_statements() as unchanged:
+            assert poll(render_page(schedule)) == (0, 0, 0)
+        with counted_statements() as mutated:
+            assert poll(render_page(changed(schedule))) == (3, 3, 3)
+        counts.append((len(initial), len(unchanged), len(mutated)))
+
+    assert counts[0] == counts[1]
@@ -0,0 +1,93 @@
+# tests/test_smtp_pool.py
+
+"""Tests SMTPConnectionPool reuse, retirement, reconnects and the throughput benchmark against the local SMTP stand-in."""
+
+import smtplib
+
+import pytest
+
+import stand_in_notifier as app
+from benchmarks.stand_ins import SMTPSink
+
+@pytest.fixture
+def sink(monkeypatch):
+    sink = SMTPSink()
+    monkeypatch.setattr(app, 'SMTP_STARTTLS', False)
+    yield sink
+    sink.stop()
+
+def make_pool(sink, **kwargs):
+    return app.SMTPConnectionPool('127.0.0.1', sink.port, 'bot@example.com', 'secret', **kwargs)
+
+def message(i=0):
+    return app.build_email(f'parent{i}@example.com', 'Test', '<p>test</p>')
+
+def test_reuses_one_connection(sink):
+    pool = make_pool(sink, size=1)
+    for i in range(10):
+        pool.send_message(message(i))
+    pool.close()
+
+    assert sink.wait_for(10, 5)
+    assert sink.logins == 1
+    assert sink.sessions == 1
+
+def test_retires_connection_at_max_messages(sink):
+    pool = make_pool(sink, size=1, max_messages=3)
+    for i in range(7):
+        pool.send_message(message(i))
+    pool.close()
+
+    assert sink.wait_for(7, 5)
+    # 3 + 3 + 1 messages
+    assert sink.logins == 3
+
+def test_send_messages_batch_retires_connections(sink):
+    pool = make_pool(sink, size=1, max_messages=4)
+    assert pool.send_messages([message(i) for i in range(10)]) == [None] * 10
+    pool.close()
+
+    assert sink.wait_for(10, 5)
+    assert sink.logins == 3
+
+def test_reconnects_once_after_server_hung_up(sink):
+    pool = make_pool(sink, size=1)
+    pool.send_message(message())
+    assert sink.wait_for(1, 5)
+
+    # The relay dropped the idle pooled connection
+    sink.drop_connections()
+    pool.send_message(message(1))
+    pool.close()
+
+    assert sink.wait_for(2, 5)
+    assert sink.logins == 2
+
+def test_gives_up_after_one_reconnect(sink):
+    pool = make_pool(sink, size=1)
+    pool.send_message(message())
+    sessions = sink.sessions
+
+    sink.hang_up = True
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        pool.send_message(message(1))
+    pool.close()
+
+    # The pooled connection and exactly one new one
+    assert sink.sessions == sessions + 1
+    assert sink.count == 1
+
+    # The pool recovers once the server accepts mail again
+    sink.hang_up = False
+    pool.send_message(message(2))
+    assert sink.wait_for(2, 5)
+
+def test_benchmark_compares_pooled_and_connection_per_message(sink):
+    from benchmarks.run import bench_smtp
+
+    results = bench_smtp(app, sink, 20)
+
+    assert results['pooled']['delivered'] == 20
+    assert results['pooled']['logins'] == 1
+    assert results['connection_per_message']['delivered'] == 20
+    assert results['connection_per_message']['logins'] == 20
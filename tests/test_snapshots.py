@@ -0,0 +1,80 @@
+# tests/test_snapshots.py
+
+"""Tests the snapshot archive and its manifest, as written by process_fetch_result."""
+
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import stand_in_notifier as app
+from benchmarks.pages import generate_schedule, mutate_schedule, render_page
+
+SOURCE = SimpleNamespace(id='school', url='http://school.example/helyettesites/')
+
+@pytest.fixture
+def snapshots(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(app, 'last_snapshots', {})
+    return str(tmp_path)
+
+def fetched(status, html=None):
+    content_hash = hashlib.sha256(html.encode()).hexdigest() if html else None
+    app.process_fetch_result(SOURCE, app.FetchResult(status, html=html, content_hash=content_hash))
+
+def manifest(directory):
+    return [(record['status'], record['hash'], html) for record, html in app.read_snapshots(directory)]
+
+def page_hash(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+def test_every_fetch_gets_a_manifest_line(snapshots):
+    first = render_page(generate_schedule(5))
+    second = render_page(mutate_schedule(generate_schedule(5), 0.5))
+
+    fetched('changed', first)
+    fetched('unchanged')
+    fetched('not_modified')
+    fetched('failed')
+    fetched('changed', second)
+    fetched('changed', first)
+
+    assert manifest(snapshots) == [
+        ('changed', page_hash(first), first),
+        ('unchanged', page_hash(first), first),
+        ('not_modified', page_hash(first), first),
+        ('changed', page_hash(second), second),
+        ('changed', page_hash(first), first),
+    ]
+    # Each page is stored once
+    stored = [name for _, _, names in os.walk(os.path.join(snapshots, 'objects')) for name in names]
+    assert len(stored) == 2
+
+def test_fetch_before_the_first_archived_page_is_not_recorded(snapshots):
+    html = render_page(generate_schedule(5))
+
+    fetched('not_modified')
+    fetched('changed', html)
+
+    assert [status for status, _, _ in manifest(snapshots)] == ['changed']
+
+def test_finds_the_last_page_in_the_manifest_after_a_restart(snapshots, monkeypatch):
+    html = render_page(generate_schedule(5))
+    fetched('changed', html)
+    monkeypatch.setattr(app, 'last_snapshots', {})
+
+    fetched('unchanged')
+
+    assert manifest(snapshots)[-1] == ('unchanged', page_hash(html), html)
+
+def test_reads_manifest_lines_without_a_status_as_changed(snapshots):
+    html = render_page(generate_schedule(5))
+    content_hash = app.archive_snapshot(SOURCE, html)
+    path = os.path.join(snapshots, app.SNAPSHOT_MANIFEST)
+    with open(path) as f:
+        line = f.read().replace('"status": "changed", ', '')
+    with open(path, 'w') as f:
+        f.write(line)
+
+    assert manifest(snapshots) == [('changed', content_hash, html)]
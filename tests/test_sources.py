@@ -0,0 +1,75 @@
+# tests/test_sources.py
+
+"""Tests register_sources: moving clients and entries of the legacy 'default' source, and reporting unscraped sources."""
+
+import logging
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+import stand_in_notifier as app
+
+DAY = date(2026, 10, 19)
+URL = 'http://school.example/helyettesites/'
+
+def add_rows(*rows):
+    with app.session_scope() as session:
+        session.add_all(rows)
+
+def entry(source_id, lesson, room='12'):
+    return app.ScheduleEntry(
+        source_id=source_id, date=DAY, lesson=lesson, class_name='9.A', missing_teacher='Nagy Anna', room=room
+    )
+
+def client(email, source_id):
+    return app.Client(email=email, name='Anna', class_name='9.A', language='english', source_id=source_id)
+
+def stored(column):
+    with app.SessionLocal() as session:
+        return session.execute(select(column.class_.source_id, column).order_by(column)).all()
+
+@pytest.fixture
+def legacy(database, monkeypatch):
+    """A database written while URL was scraped as the 'default' source."""
+    monkeypatch.setattr(app, 'URL', URL)
+    app.register_sources()
+    add_rows(client('anna@example.com', 'default'), entry('default', '1'), entry('default', '2', room='13'))
+
+def test_legacy_source_moves_to_default_source(legacy, monkeypatch):
+    # Switched to SOURCES as the README describes; the scraper already stored lesson 2 under the new id
+    monkeypatch.setattr(app, 'SOURCES', f'karinthy={URL}')
+    monkeypatch.setattr(app, 'DEFAULT_SOURCE', 'karinthy')
+    add_rows(entry('karinthy', '2', room='14'))
+    app.register_sources()
+
+    assert stored(app.Client.email) == [('karinthy', 'anna@example.com')]
+    assert stored(app.ScheduleEntry.lesson) == [('karinthy', '1'), ('karinthy', '2')]
+    assert stored(app.ScheduleEntry.room) == [('karinthy', '12'), ('karinthy', '14')]
+    with app.SessionLocal() as session:
+        assert session.get(app.Source, 'default').enabled is False
+        assert session.get(app.Source, 'karinthy').enabled is True
+
+def test_renamed_default_source_adopts_legacy_rows(legacy, monkeypatch):
+    monkeypatch.setattr(app, 'DEFAULT_SOURCE', 'karinthy')
+    app.register_sources()
+
+    assert stored(app.Client.email) == [('karinthy', 'anna@example.com')]
+    assert stored(app.ScheduleEntry.lesson) == [('karinthy', '1'), ('karinthy', '2')]
+
+def test_configured_legacy_source_is_kept(legacy):
+    app.register_sources()
+
+    assert stored(app.Client.email) == [('default', 'anna@example.com')]
+    assert stored(app.ScheduleEntry.lesson) == [('default', '1'), ('default', '2')]
+
+def test_reports_sources_that_are_not_scraped(database, monkeypatch, caplog):
+    monkeypatch.setattr(app, 'SOURCES', f'karinthy={URL}')
+    add_rows(client('anna@example.com', 'karinthy'), client('bence@example.com', 'other'))
+    with caplog.at_level(logging.ERROR):
+        app.register_sources()
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "DEFAULT_SOURCE 'default' is not enabled, so START commands need a 'School:' line.",
+        "1 clients are registered with source 'other', which is not enabled; they get no notifications.",
+    ]
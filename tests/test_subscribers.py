@@ -0,0 +1,160 @@
+# tests/test_subscribers.py
+
+"""Tests who SubscriberIndex.resolve picks for an entry, and parse_subscription_rules."""
+
+from types import SimpleNamespace
+
+import pytest
+
+import stand_in_notifier as app
+
+def entry(class_name='9.A', subject='matematika', missing_teacher='Nagy Anna', stand_in_teacher='Kiss Péter', source_id='school'):
+    return SimpleNamespace(
+        source_id=source_id, class_name=class_name, subject=subject,
+        missing_teacher=missing_teacher, stand_in_teacher=stand_in_teacher
+    )
+
+@pytest.fixture
+def index(database):
+    """An empty, loaded index; subscribers are added with add()."""
+    index = app.SubscriberIndex()
+    index.load()
+    return index
+
+def add(index, email, class_name='9.A', language='english', rules=(), source_id='school'):
+    index.upsert(email, email.split('@')[0], class_name, language, source_id, rules)
+
+def recipients(index, *entries):
+    return [sorted(emails) for emails in index.resolve(entries)]
+
+def test_class_is_an_implicit_include_rule(index):
+    add(index, 'anna@example.com', class_name='9.a')
+    add(index, 'bence@example.com', class_name='10.B')
+
+    assert recipients(index, entry(), entry(class_name='10.b'), entry(class_name='11.C')) == [
+        ['anna@example.com'], ['bence@example.com'], []
+    ]
+    # Classes of another school don't match
+    assert recipients(index, entry(source_id='other')) == [[]]
+
+def test_teacher_rules_match_missing_and_stand_in_teacher(index):
+    add(index, 'anna@example.com', class_name='12.F', rules=[('include', 'teacher', 'nagy  anna')])
+
+    assert recipients(index,
+        entry(class_name='10.A', missing_teacher='Nagy Anna', stand_in_teacher='Kiss Péter'),
+        entry(class_name='10.B', missing_teacher='Kiss Péter', stand_in_teacher='NAGY ANNA'),
+        entry(class_name='10.C', missing_teacher='Kiss Péter', stand_in_teacher='Tóth Gábor'),
+    ) == [['anna@example.com'], ['anna@example.com'], []]
+
+def test_subject_and_extra_class_rules_reach_other_classes(index):
+    add(index, 'anna@example.com', rules=[('include', 'subject', 'fizika'), ('include', 'class', '10.B')])
+
+    assert recipients(index,
+        entry(class_name='11.C', subject='Fizika'),
+        entry(class_name='10.B'),
+        entry(class_name='11.C'),
+    ) == [['anna@example.com'], ['anna@example.com'], []]
+
+@pytest.mark.parametrize('field, value, excluded_entry', [
+    ('class', '9.A', entry()),
+    ('subject', 'testnevelés', entry(subject='Testnevelés')),
+    ('teacher', 'kiss péter', entry()),
+    ('teacher', 'nagy anna', entry()),
+])
+def test_exclude_rules_win_over_includes(index, field, value, excluded_entry):
+    add(index, 'anna@example.com', rules=[
+        ('include', 'teacher', 'kiss péter'), ('include', 'subject', 'testnevelés'), ('exclude', field, value)
+    ])
+    add(index, 'bence@example.com')
+
+    assert recipients(index, excluded_entry) == [['bence@example.com']]
+
+def test_lessons_of_another_second_language_are_left_out(index):
+    add(index, 'anna@example.com', language='english')
+    add(index, 'bence@example.com', language='német')
+    add(index, 'csaba@example.com', language='none')
+    add(index, 'dora@example.com', language='english', rules=[('include', 'subject', 'német nyelv')])
+
+    assert recipients(index, entry(subject='angol nyelv'), entry(subject='német nyelv'), entry(subject='matematika')) == [
+        ['anna@example.com', 'csaba@example.com', 'dora@example.com'],
+        # Dóra includes German lessons explicitly; Csaba's language is unknown, so nothing is filtered
+        ['bence@example.com', 'csaba@example.com', 'dora@example.com'],
+        ['anna@example.com', 'bence@example.com', 'csaba@example.com', 'dora@example.com'],
+    ]
+
+def test_upsert_and_remove_update_the_postings(index):
+    add(index, 'anna@example.com', rules=[('include', 'subject', 'fizika')])
+    add(index, 'anna@example.com', class_name='10.B')
+    assert recipients(index, entry(), entry(class_name='10.B'), entry(class_name='11.C', subject='fizika')) == [
+        [], ['anna@example.com'], []
+    ]
+
+    index.remove('anna@example.com')
+    assert recipients(index, entry(class_name='10.B')) == [[]]
+    assert index.stats()['clients'] == 0
+    assert index.stats()['keys'] == 0
+
+def test_load_reads_clients_and_rules(database):
+    app.store_client_changes({
+        'anna@example.com': ('Anna', '9.A', 'english', 'school', [('exclude', 'subject', 'matematika')]),
+        'bence@example.com': ('Bence', '10.B', 'german', 'school', [('include', 'class', '9.A')]),
+    })
+    index = app.SubscriberIndex()
+    index.load()
+
+    assert recipients(index, entry(), entry(subject='fizika')) == [
+        ['bence@example.com'], ['anna@example.com', 'bence@example.com']
+    ]
+
+def test_parse_subscription_rules():
+    body = (
+        "Name: Kovács Anna\n"
+        "Class: 10.be, 11.a ,, 12.C\n"
+        "Language: English\n"
+        "Teacher: Nagy  Anna, KISS Péter\n"
+        "Subject: Fizika\n"
+        "exclude   SUBJECT: testnevelés, Fizika\n"
+        "Exclude Teacher: Tóth Gábor\n"
+        "Exclude Class: 11.A\n"
+        "Teacher: nagy anna\n"
+        "Remark: Teacher: Szabó Éva\n"
+    )
+    assert app.parse_subscription_rules(body) == [
+        ('include', 'class', '11.A'),
+        ('include', 'class', '12.C'),
+        ('include', 'teacher', 'nagy anna'),
+        ('include', 'teacher', 'kiss péter'),
+        ('include', 'subject', 'fizika'),
+        ('exclude', 'subject', 'testnevelés'),
+        ('exclude', 'subject', 'fizika'),
+        ('exclude', 'teacher', 'tóth gábor'),
+        ('exclude', 'class', '11.A'),
+    ]
+    # The first class is the client's own, not a rule
+    assert app.parse_client_info(body)[1] == '10.BE'
+
+def test_parse_subscription_rules_without_rules():
+    assert app.parse_subscription_rules("Name: Anna\nClass: 9.A\nLanguage: English\n") == []
+
+def test_refresh_reloads_only_for_changes_of_other_processes(database, monkeypatch):
+    index = app.subscriber_index
+    loads = []
+    load = index.load
+    monkeypatch.setattr(index, 'load', lambda: loads.append(True) or load())
+
+    # Changes stored by this process are applied incrementally
+    app.store_client_changes({'anna@example.com': ('Anna', '9.A', 'english', 'school', [])})
+    app.store_client_changes({'anna@example.com': None, 'bence@example.com': ('Bence', '9.A', 'english', 'school', [])})
+    index.refresh()
+    assert loads == []
+    assert recipients(index, entry()) == [['bence@example.com']]
+
+    # A registration stored by another replica
+    with app.session_scope() as session:
+        session.add(app.Client(email='csaba@example.com', name='Csaba', class_name='9.A', language='english', source_id='school'))
+        app.count_change(session, app.SUBSCRIBER_CHANGES)
+    index.refresh()
+    assert loads == [True]
+    assert recipients(index, entry()) == [['bence@example.com', 'csaba@example.com']]
+    index.refresh()
+    assert loads == [True]